@@ -0,0 +1,415 @@
+# Benchmarking functions
+
+
+################ Imports ################
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+import json
+import platform
+import subprocess
+from contextlib import redirect_stdout
+
+import numpy as np
+import pandas as pd
+
+import wrangle as w
+import evaluate as ev
+import predict as pr
+import synthetic as sy
+
+
+#################################### cache format benchmark ####################################
+
+# runs one read in a brand new python process and prints how long the read took
+_cold_read_script = '''
+import sys, time
+import wrangle as w
+start = time.perf_counter()
+w.read_cache(sys.argv[1], cache_format=sys.argv[2], memory_map=sys.argv[3] == 'True')
+print(time.perf_counter() - start)
+'''
+
+def time_cache_formats(df, formats=('csv', 'parquet', 'feather'), repeats=5, memory_map=True):
+    '''
+    Takes in a dataframe (ex: the output of get_zillow_data), writes it once in each cache format
+    and times reading it back.
+    cold_s: first read in a fresh python process (nothing imported or cached by python yet)
+    warm_s: best of repeats reads in this process, right after the cold read
+    Returns a dataframe with one row per format, plus the size of the file on disk.
+    '''
+    rows = []
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for cache_format in formats:
+            path = os.path.join(tmp_dir, f'bench.{cache_format}')
+
+            start = time.perf_counter()
+            w.write_cache(df, path, cache_format=cache_format)
+            write_s = time.perf_counter() - start
+
+            # cold read, separate process so the reader library is not already imported
+            out = subprocess.run([sys.executable, '-c', _cold_read_script, path, cache_format, str(memory_map)],
+                                 capture_output=True, text=True, check=True,
+                                 cwd=os.path.dirname(os.path.abspath(w.__file__)))
+            cold_s = float(out.stdout.strip().splitlines()[-1])
+
+            # warm reads
+            warm = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                w.read_cache(path, cache_format=cache_format, memory_map=memory_map)
+                warm.append(time.perf_counter() - start)
+
+            rows.append({'format': cache_format,
+                         'write_s': write_s,
+                         'cold_s': cold_s,
+                         'warm_s': min(warm),
+                         'size_mb': os.path.getsize(path) / 1e6})
+
+    return pd.DataFrame(rows).set_index('format')
+
+
+#################################### wrangle path benchmark ####################################
+
+def _measure(func, *args, **kwargs):
+    '''
+    Runs func once, returns (result, wall seconds, peak traced memory in MB).
+    '''
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = func(*args, **kwargs)
+        wall_s = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return result, wall_s, peak / 1e6
+
+
+def compare_wrangle_paths(df):
+    '''
+    Takes in the raw Zillow data (ex: get_zillow_data()) and wrangles it with clean_zillow (step by step),
+    fused_wrangle, and fused_wrangle with downcast dtypes.
+    Checks that the step by step and fused outputs are identical.
+    Returns a dataframe with the wall time, peak memory while wrangling and memory of the result for each path.
+    '''
+    rows = []
+    results = {}
+    paths = {'step_by_step': w.clean_zillow,
+             'fused': w.fused_wrangle,
+             'fused_downcast': lambda raw: w.fused_wrangle(raw, downcast=True)}
+
+    for name, func in paths.items():
+        # every path gets its own copy, pool_and_garage fills in place
+        result, wall_s, peak_mb = _measure(func, df.copy())
+        results[name] = result
+        rows.append({'path': name,
+                     'wall_s': wall_s,
+                     'peak_mb': peak_mb,
+                     'result_mb': result.memory_usage(deep=True).sum() / 1e6,
+                     'rows': len(result)})
+
+    pd.testing.assert_frame_equal(results['step_by_step'], results['fused'])
+
+    return pd.DataFrame(rows).set_index('path')
+
+
+#################################### prediction latency benchmark ####################################
+
+def time_predictions(model, df, batch_sizes=(1, 10, 100, 1_000, 10_000, 100_000), seed=713):
+    '''
+    Times predict.predict_frame on batches of records of each size (rows are drawn from df with replacement,
+    so df can be smaller than the biggest batch).
+    model: from predict.load_bundle
+    Every size gets about 200,000 rows worth of batches (at least 5, at most 1,000).
+    Returns a dataframe with one row per batch size: median and 95th percentile latency per batch in ms,
+    and throughput in rows per second (from the median).
+    '''
+    rows = []
+    rng = np.random.default_rng(seed)
+
+    for size in batch_sizes:
+        latencies = []
+        for _ in range(min(max(200_000 // size, 5), 1_000)):
+            # a new random batch every time, drawn before the clock starts
+            batch = df.iloc[rng.integers(0, len(df), size)].reset_index(drop=True)
+            start = time.perf_counter()
+            pr.predict_frame(model, batch)
+            latencies.append(time.perf_counter() - start)
+
+        latencies = np.array(latencies)
+        rows.append({'batch_size': size,
+                     'batches': len(latencies),
+                     'median_ms': np.median(latencies) * 1e3,
+                     'p95_ms': np.quantile(latencies, .95) * 1e3,
+                     'rows_per_s': size / np.median(latencies)})
+
+    return pd.DataFrame(rows).set_index('batch_size')
+
+
+#################################### scaling benchmark suite ####################################
+
+def _suite_cases(tmp_dir):
+    '''
+    The functions the suite times, as (name, setup, func): setup takes the raw synthetic data and returns
+    the arguments for func (setup isn't timed).
+    '''
+    from sklearn.preprocessing import MinMaxScaler
+
+    features = ['sqft_calculated', 'bedroom_cnt', 'bathroom_cnt']
+
+    def wrangled(raw):
+        return w.fused_wrangle(raw.copy())
+
+    def split(raw):
+        return w.banana_split(wrangled(raw))
+
+    def split_miss(raw):
+        # an empty cache directory for every run, so each run works out the split
+        return wrangled(raw), tempfile.mkdtemp(dir=tmp_dir)
+
+    def split_hit(raw):
+        # the split is already saved, so this times reading it back
+        df, cache_dir = split_miss(raw)
+        w.split_indices(df, cache_dir=cache_dir)
+        return df, cache_dir
+
+    def xy(raw):
+        df = wrangled(raw)
+        return df[features], df.tax_value
+
+    def predictions(raw):
+        df = wrangled(raw)
+        return df.tax_value.to_numpy(), (df.sqft_calculated * 250).to_numpy()
+
+    return [('clean_zillow', lambda raw: (raw.copy(),), w.clean_zillow),
+            ('fused_wrangle', lambda raw: (raw.copy(),), w.fused_wrangle),
+            ('missing_values_table', lambda raw: (raw,), w.missing_values_table),
+            ('remove_outlier', lambda raw: (wrangled(raw)[features],), w.remove_outlier),
+            ('banana_split', lambda raw: (wrangled(raw),), w.banana_split),
+            ('split_indices', split_miss, lambda df, cache_dir: w.split_indices(df, cache_dir=cache_dir)),
+            ('split_indices_cached', split_hit, lambda df, cache_dir: w.split_indices(df, cache_dir=cache_dir)),
+            ('scale_columns', split,
+             lambda train, validate, test: w.scale_columns(train, validate, test, features, MinMaxScaler(), 'mm')),
+            ('select_kbest', xy, lambda X, y: ev.select_kbest(X, y, 2)),
+            ('rfe', xy, lambda X, y: ev.rfe(X, y, 2)),
+            ('hip_to_be_square', predictions, ev.hip_to_be_square),
+            ('regression_metrics', predictions, ev.regression_metrics)]
+
+
+def run_suite(sizes=(10_000, 100_000, 1_000_000, 10_000_000), repeats=3, seed=713, results_path=None,
+              baseline_path=None, tolerance=.25):
+    '''
+    Times the wrangle, scaling, splitting, feature selection and metric functions on synthetic Zillow data
+    (synthetic.make_zillow_data) of every size in sizes.
+    wall_s is the best of repeats runs, peak_mb the peak traced memory of one more run (see _measure).
+    results_path: save the results to this json file (ex: to use as the next baseline)
+    baseline_path: json file from an earlier run to compare against (see compare_to_baseline)
+    Returns the results dataframe (one row per function and size), or the comparison if there is a baseline.
+    '''
+    rows = []
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cases = _suite_cases(tmp_dir)
+        for size in sizes:
+            raw = sy.make_zillow_data(size, seed=seed)
+            for name, setup, func in cases:
+                # some of the functions print, keep the output clean
+                with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+                    # best time of repeats without tracing (tracemalloc slows things down), then one traced run
+                    walls = []
+                    for _ in range(repeats):
+                        args = setup(raw)
+                        start = time.perf_counter()
+                        func(*args)
+                        walls.append(time.perf_counter() - start)
+                    _, _, peak_mb = _measure(func, *setup(raw))
+                rows.append({'function': name, 'rows': size, 'wall_s': min(walls), 'peak_mb': peak_mb})
+
+    results = pd.DataFrame(rows)
+
+    if results_path is not None:
+        with open(results_path, 'w') as f:
+            json.dump({'python': platform.python_version(),
+                       'pandas': pd.__version__,
+                       'numpy': np.__version__,
+                       'machine': platform.platform(),
+                       'seed': seed,
+                       'repeats': repeats,
+                       'results': rows}, f, indent=2)
+
+    if baseline_path is not None:
+        return compare_to_baseline(results, baseline_path, tolerance)
+
+    return results
+
+
+def compare_to_baseline(results, baseline_path, tolerance=.25):
+    '''
+    Compares suite results with a baseline saved by run_suite.
+    tolerance: how much slower (or more memory) counts as a regression, .25 is 25%
+    Returns a dataframe with the baseline and current time and memory for every function and size that's in both,
+    their ratios (current / baseline) and a regression column.
+    '''
+    with open(baseline_path) as f:
+        baseline = pd.DataFrame(json.load(f)['results'])
+
+    compared = results.merge(baseline, on=['function', 'rows'], suffixes=('', '_baseline'))
+    compared['wall_ratio'] = compared.wall_s / compared.wall_s_baseline
+    compared['peak_ratio'] = compared.peak_mb / compared.peak_mb_baseline
+    compared['regression'] = (compared.wall_ratio > 1 + tolerance) | (compared.peak_ratio > 1 + tolerance)
+
+    return compared.set_index(['function', 'rows'])
+
+
+#################################### import time benchmark ####################################
+
+def _importtime(module):
+    '''
+    Imports module in a fresh python process with -X importtime.
+    Returns a dataframe with the self and cumulative time (ms) of every import it did, and how deep it was nested.
+    '''
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                         capture_output=True, text=True, check=True,
+                         cwd=os.path.dirname(os.path.abspath(w.__file__)))
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append({'module': name.strip(),
+                     'depth': (len(name) - len(name.lstrip()) - 1) // 2,
+                     'self_ms': int(self_us) / 1e3,
+                     'cumulative_ms': int(cumulative_us) / 1e3})
+
+    return pd.DataFrame(rows)
+
+
+def time_imports(modules=('wrangle', 'explore', 'evaluate', 'predict'), repeats=5, top=5):
+    '''
+    Times importing each module in a brand new python process (python -X importtime), the cost every
+    worker process and command line run pays before doing anything.
+    repeats: runs per module, the median is reported
+    top: how many of the slowest imports (pulled in directly by the module) to list
+    Returns a dataframe with one row per module: import_ms and its slowest direct imports.
+    '''
+    rows = []
+
+    for module in modules:
+        runs = [_importtime(module) for _ in range(repeats)]
+        totals = [run.loc[run.module == module, 'cumulative_ms'].iloc[-1] for run in runs]
+
+        # direct imports are one level down from the module, listed between it and the top level import before it
+        last = runs[-1].reset_index(drop=True)
+        end = last.index[last.module == module][-1]
+        start = last.index[(last.depth == 0) & (last.index < end)].max()
+        block = last.iloc[(0 if pd.isna(start) else start + 1):end]
+        direct = block[block.depth == 1].nlargest(top, 'cumulative_ms')
+        rows.append({'module': module,
+                     'import_ms': float(np.median(totals)),
+                     'slowest': ', '.join(f'{name} {ms:.0f}ms' for name, ms in zip(direct.module, direct.cumulative_ms))})
+
+    return pd.DataFrame(rows).set_index('module')
+
+
+#################################### sql pushdown check ####################################
+
+def make_sqlite_zillow(path, n_rows=100_000, seed=713):
+    '''
+    Writes a SQLite stand-in for the Codeup zillow database (properties_2017 and predictions_2017, just the columns
+    the query uses) from synthetic.make_zillow_data, so queries can be tried without the real server.
+    A few rows get a 0 tax value (with and without a tax amount) to cover the 0 / 0 and x / 0 tax rates.
+    Returns the sqlalchemy url, ex: wrangle.register_database('zillow', make_sqlite_zillow('zillow.db'))
+    '''
+    import sqlite3
+
+    df = sy.make_zillow_data(n_rows, seed=seed)
+    df.loc[df.index[:10], 'tax_value'] = 0
+    df.loc[df.index[:5], 'tax_amount'] = 0
+
+    # one property row per parcel, one transaction row per row of the data (duplicates come back through the join)
+    properties = (df.drop_duplicates('parcel_id')
+                  .rename(columns={'parcel_id': 'parcelid', 'tax_value': 'taxvaluedollarcnt', 'bathroom_cnt': 'bathroomcnt',
+                                   'bedroom_cnt': 'bedroomcnt', 'sqft_calculated': 'calculatedfinishedsquarefeet',
+                                   'has_pool': 'poolcnt', 'garage_car_count': 'garagecarcnt', 'tax_amount': 'taxamount'})
+                  .drop(columns='transaction_date')
+                  .assign(propertylandusetypeid=261))
+    predictions = pd.DataFrame({'parcelid': df.parcel_id, 'transactiondate': df.transaction_date.dt.strftime('%Y-%m-%d')})
+
+    if os.path.exists(path):
+        os.remove(path)
+    with sqlite3.connect(path) as con:
+        properties.to_sql('properties_2017', con, index=False)
+        predictions.to_sql('predictions_2017', con, index=False)
+
+    return f'sqlite:///{path}'
+
+
+def verify_pushdown(n_rows=100_000, seed=713, pushdown=True):
+    '''
+    Checks that wrangling with the steps pushed down into sql gives the same frame as wrangling in pandas,
+    on a SQLite stand-in made by make_sqlite_zillow (points the 'zillow' database at it for this process).
+    The pushed down frame has its own index (0 to n - 1 from the query), so the indexes are reset before comparing.
+    Fips codes other than 6037, 6059 and 6111 would come back with a NULL county instead of the number,
+    the stand-in only has those three.
+    Returns a dataframe with the rows and columns each path pulled, and the time and peak traced memory
+    to pull and to wrangle (traced, so slower than normal, see _measure).
+    '''
+    rows = []
+    results = {}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        w.register_database('zillow', make_sqlite_zillow(os.path.join(tmp_dir, 'zillow.db'), n_rows, seed))
+        try:
+            for name, steps in (('pandas', False), ('pushdown', pushdown)):
+                raw, pull_s, pull_mb = _measure(w.get_zillow_data, cache_dir=tmp_dir, pushdown=steps)
+                pushed = w._pushdown_steps(steps)
+                result, wrangle_s, wrangle_mb = _measure(w.run_stages, raw.copy(), w.clean_zillow_stages[len(pushed):])
+                results[name] = result
+                rows.append({'path': name, 'rows_pulled': len(raw), 'columns_pulled': raw.shape[1],
+                             'pull_s': pull_s, 'pull_peak_mb': pull_mb,
+                             'wrangle_s': wrangle_s, 'wrangle_peak_mb': wrangle_mb, 'rows': len(result)})
+        finally:
+            w.dispose_engines('zillow')
+
+    pd.testing.assert_frame_equal(results['pandas'].reset_index(drop=True), results['pushdown'].reset_index(drop=True))
+
+    return pd.DataFrame(rows).set_index('path')
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['suite']:
+        # python benchmark.py suite [results.json] [baseline.json]
+        print(run_suite(results_path=(sys.argv[2:3] or [None])[0], baseline_path=(sys.argv[3:4] or [None])[0]))
+        sys.exit()
+
+    if sys.argv[1:2] == ['pushdown']:
+        print(verify_pushdown())
+        sys.exit()
+
+    if sys.argv[1:2] == ['predictions']:
+        # python benchmark.py predictions [bundle.json]
+        # without a bundle, a LinearRegression fit on synthetic data stands in for the saved model
+        raw = sy.make_zillow_data(200_000)
+        if sys.argv[2:3]:
+            model = pr.load_bundle(sys.argv[2])
+        else:
+            from sklearn.linear_model import LinearRegression
+
+            df = w.fused_wrangle(raw.copy())
+            features = ['sqft_calculated', 'bedroom_cnt', 'bathroom_cnt', 'has_pool', 'has_garage']
+            model = pr.compile_bundle(pr.make_bundle(LinearRegression().fit(df[features], df.tax_value), features))
+        print(time_predictions(model, raw))
+        sys.exit()
+
+    if sys.argv[1:2] == ['imports']:
+        print(time_imports())
+        sys.exit()
+
+    raw = w.get_zillow_data()
+    print(time_cache_formats(raw))
+    print(compare_wrangle_paths(raw))
@@ -1,11 +1,10 @@
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
 
-from sklearn.metrics import r2_score, mean_squared_error
-from sklearn.linear_model import LinearRegression
-from sklearn.feature_selection import SelectKBest, f_regression, RFE
+# matplotlib, seaborn and sklearn are imported in the functions that use them, so importing evaluate stays quick
+
+import explore as ex
+import wrangle as w
 
 ################################################################################################
 def sse_compare(sse1, sse2, model1, model2 = 'baseline'):
@@ -24,16 +23,86 @@ def sse_compare(sse1, sse2, model1, model2 = 'baseline'):
         print(f'{model1} performs the same as {model2}')
 
 ################################################################################################
-def plot_residuals(df, x_list, palette = "tab10"):
+def _binned_counts(block, edges):
+    # histogram of every column of block on the same edges, with one bincount. Same counts as np.histogram:
+    # NaNs and values outside the edges are left out, the last bin includes its right edge
+    n_bins = len(edges) - 1
+    cols = np.broadcast_to(np.arange(block.shape[1]), block.shape)
+    keep = ~np.isnan(block) & (block >= edges[0]) & (block <= edges[-1])
+    values, cols = block[keep], cols[keep]
+
+    widths = np.diff(edges)
+    if np.allclose(widths, widths[0], rtol = 1e-9, atol = 0):
+        # equal width bins: the bin is one division away, then fix values that rounding put next to their bin
+        idx = np.clip(((values - edges[0]) / widths[0]).astype(np.int64), 0, n_bins - 1)
+        idx[values < edges[idx]] -= 1
+        idx[(values >= edges[idx + 1]) & (idx != n_bins - 1)] += 1
+    else:
+        idx = np.clip(np.searchsorted(edges, values, side = 'right') - 1, 0, n_bins - 1)
+
+    # offset each column into its own run of bins
+    return np.bincount(idx + cols * n_bins, minlength = block.shape[1] * n_bins).reshape(block.shape[1], n_bins)
+
+
+def residual_densities(df, x_list, bins = 'auto', kde_points = 512):
+    '''
+    Histogram and KDE of every residual column in x_list, all at once, on shared bins so models can be compared.
+    The KDE is a binned KDE (counts convolved with a Gaussian using an FFT, see explore.kde_from_counts)
+    with Scott's rule bandwidth for each column, instead of a kernel for every row.
+    bins: shared histogram bins, anything np.histogram_bin_edges takes. Default 'auto'
+    kde_points: number of points on the KDE grid
+    Returns a dictionary of arrays:
+        names: the column names, in the order of the rows below
+        n: number of (non null) residuals per column
+        edges: shared histogram bin edges
+        counts: histogram counts, one row per column
+        kde_x: shared KDE grid
+        kde_density: KDE density on kde_x, one row per column
+    ex: dens = residual_densities(df, ['resid_ols', 'resid_lars']); dens['kde_density'][0] - dens['kde_density'][1]
+    '''
+    x_list = list(x_list)
+    block = df[x_list].to_numpy(dtype = float)
+
+    # shared edges from all the residuals together
+    values = block[~np.isnan(block)]
+    edges = np.histogram_bin_edges(values, bins = bins)
+    kde_edges = np.linspace(edges[0], edges[-1], kde_points + 1)
+
+    counts = _binned_counts(block, edges)
+    kde_counts = _binned_counts(block, kde_edges)
+
+    n = (~np.isnan(block)).sum(axis = 0)
+    bandwidth = np.nanstd(block, axis = 0, ddof = 1) * n ** (-1 / 5)
+    kde_density = ex.kde_from_counts(kde_counts, kde_edges[1] - kde_edges[0], bandwidth)
+
+    return {'names': x_list,
+            'n': n,
+            'edges': edges,
+            'counts': counts,
+            'kde_x': (kde_edges[:-1] + kde_edges[1:]) / 2,
+            'kde_density': kde_density}
+
+
+def plot_residuals(df, x_list, palette = "tab10", densities = None):
     '''
     This function takes in a dataframe and a list of all the risiduals you would like to plot (that means the names of the columns)
+    Optional arguement densities: output of residual_densities, if you already have it. Default is to make it from df
     '''
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    densities = residual_densities(df, x_list) if densities is None else densities
+
     color_list= list(sns.color_palette(palette))
     fig, ax = plt.subplots(figsize=(10, 5))
-    for x, c in zip(x_list, color_list):
-        sns.histplot(x = x, data = df, kde=True, ax = ax, alpha = 0.5, color = c, legend=True, lw = .1)
-    
-    plt.legend(x_list)  
+    bin_width = densities['edges'][1] - densities['edges'][0]
+    for i, (x, c) in enumerate(zip(densities['names'], color_list)):
+        ax.stairs(densities['counts'][i], densities['edges'], fill = True, alpha = 0.5, color = c, label = x)
+        # kde scaled to counts, like histplot(kde=True)
+        ax.plot(densities['kde_x'], densities['kde_density'][i] * densities['n'][i] * bin_width, color = c)
+
+    ax.set_ylabel('Count')
+    plt.legend()
     plt.show()
 
 ################################################################################################
@@ -100,16 +169,13 @@ def better_than_baseline(y, yhat):
     This function takes in actuals (y) and predictions (yhat) 
     and returns true if the model performs better than baseline. 
     '''
-    # calculate values for baseline
-    sse_b, mse_b, rmse_b = baseline_mean_errors(y)
-    
-    # calculate values for model
-    sse, mse, rmse_model, ess, tss = hip_to_be_square(y, yhat, print_out=False)
+    # calculate values for model and baseline in one go
+    metrics = regression_metrics(y, yhat)
     
     # compare rmse from baseline and model
     
     # If Root Mean Square Error is smaller for the model than for the baseline, model is better, return True
-    if rmse_model < rmse_b:
+    if metrics['rmse'] < metrics['rmse_baseline']:
         return True
     # if Root mean Square error for the model is larger or the same as the baseline, return False 
     else:
@@ -117,12 +183,302 @@ def better_than_baseline(y, yhat):
 
 ################################################################################################
 
-def select_kbest(X, y, k, score_func=f_regression):
+def regression_metrics(y, yhat):
+    '''
+    This function takes in the actuals (y) and predictions (yhat) and computes every metric in one go,
+    straight on the numpy arrays (no in between Series, y.mean() only once).
+    Returns a dictionary with:
+    sse, mse, rmse, ess, tss (same as hip_to_be_square), r2, mae,
+    sse_baseline, mse_baseline, rmse_baseline, mae_baseline (same as baseline_mean_errors, baseline is the mean of y)
+    rmse_delta, mae_delta: baseline minus model (positive means the model is better than baseline)
+    '''
+    y = np.asarray(y, dtype=float)
+    yhat = np.asarray(yhat, dtype=float)
+    n = y.shape[0]
+    y_mean = y.mean()
+    
+    y_centered = y - y_mean
+    error = y - yhat
+    explained = yhat - y_mean
+    
+    # dot products are sums of squares without making a squared copy
+    sse = error @ error
+    ess = explained @ explained
+    tss = y_centered @ y_centered
+    mae = np.abs(error).sum() / n
+    mae_b = np.abs(y_centered).sum() / n
+    
+    # the baseline predicts the mean, so its Sum of Squared Error is the Total Sum of Squares
+    metrics = {'sse': sse, 'mse': sse / n, 'rmse': (sse / n) ** .5, 'ess': ess, 'tss': tss,
+               'r2': 1 - sse / tss, 'mae': mae,
+               'sse_baseline': tss, 'mse_baseline': tss / n, 'rmse_baseline': (tss / n) ** .5, 'mae_baseline': mae_b}
+    metrics['rmse_delta'] = metrics['rmse_baseline'] - metrics['rmse']
+    metrics['mae_delta'] = mae_b - mae
+    
+    return metrics
+
+################################################################################################
+
+def regression_metrics_batch(y, yhat_matrix, model_names=None):
+    '''
+    Same as regression_metrics, for many models at once.
+    y: actuals, n rows
+    yhat_matrix: 2d array of predictions, one row per model (models x n). A dataframe with one column
+    per model also works (its column names are used as the model names).
+    model_names: optional list of names for the rows of the output
+    Returns a dataframe with one row per model and the regression_metrics as columns.
+    '''
+    if isinstance(yhat_matrix, pd.DataFrame):
+        model_names = list(yhat_matrix.columns) if model_names is None else model_names
+        yhat_matrix = yhat_matrix.to_numpy(dtype=float).T
+    
+    y = np.asarray(y, dtype=float)
+    yhat_matrix = np.atleast_2d(np.asarray(yhat_matrix, dtype=float))
+    n = y.shape[0]
+    y_mean = y.mean()
+    
+    y_centered = y - y_mean
+    tss = y_centered @ y_centered
+    mae_b = np.abs(y_centered).sum() / n
+    
+    # one models x n error matrix, row wise dot products give every model's sums of squares
+    error = y - yhat_matrix
+    sse = np.einsum('ij,ij->i', error, error)
+    mae = np.abs(error).sum(axis=1) / n
+    
+    # ess = sum((yhat - mean)^2), reuse the error buffer for yhat - mean
+    np.subtract(yhat_matrix, y_mean, out=error)
+    ess = np.einsum('ij,ij->i', error, error)
+    
+    rmse = (sse / n) ** .5
+    rmse_b = (tss / n) ** .5
+    
+    metrics = pd.DataFrame({'sse': sse, 'mse': sse / n, 'rmse': rmse, 'ess': ess, 'tss': tss,
+                            'r2': 1 - sse / tss, 'mae': mae,
+                            'sse_baseline': tss, 'mse_baseline': tss / n, 'rmse_baseline': rmse_b, 'mae_baseline': mae_b,
+                            'rmse_delta': rmse_b - rmse, 'mae_delta': mae_b - mae},
+                           index=model_names)
+    
+    return metrics
+
+################################################################################################
+
+class MetricAccumulator:
+    '''
+    Keeps the sufficient statistics for the regression metrics (n, sum of y, sum of y^2, sum of yhat, sum of yhat^2,
+    sum of y * yhat and sum of absolute errors), so predictions can be scored chunk by chunk.
+    Accumulators from different chunks or workers can be combined with merge (or +).
+    metrics() gives the same sse, mse, rmse, ess, tss as hip_to_be_square on all the rows at once
+    (up to floating point rounding), plus r2 and mae.
+    ex: 
+        acc = MetricAccumulator()
+        for y_chunk, yhat_chunk in chunks:
+            acc.update(y_chunk, yhat_chunk)
+        sse, mse, rmse, ess, tss = acc.hip_to_be_square()
+    '''
+    def __init__(self):
+        self.n = 0
+        self.sum_y = 0.0
+        self.sum_y2 = 0.0
+        self.sum_yhat = 0.0
+        self.sum_yhat2 = 0.0
+        self.sum_y_yhat = 0.0
+        self.sum_abs_error = 0.0
+
+    def update(self, y, yhat):
+        '''
+        Adds a chunk of actuals (y) and predictions (yhat).
+        '''
+        y = np.asarray(y, dtype=float)
+        yhat = np.asarray(yhat, dtype=float)
+        
+        self.n += y.shape[0]
+        self.sum_y += y.sum()
+        self.sum_y2 += y @ y
+        self.sum_yhat += yhat.sum()
+        self.sum_yhat2 += yhat @ yhat
+        self.sum_y_yhat += y @ yhat
+        self.sum_abs_error += np.abs(y - yhat).sum()
+        
+        return self
+
+    def merge(self, other):
+        '''
+        Adds the chunks counted by another MetricAccumulator.
+        '''
+        self.n += other.n
+        self.sum_y += other.sum_y
+        self.sum_y2 += other.sum_y2
+        self.sum_yhat += other.sum_yhat
+        self.sum_yhat2 += other.sum_yhat2
+        self.sum_y_yhat += other.sum_y_yhat
+        self.sum_abs_error += other.sum_abs_error
+        
+        return self
+
+    def __add__(self, other):
+        return MetricAccumulator().merge(self).merge(other)
+
+    def metrics(self):
+        '''
+        Returns a dictionary with sse, mse, rmse, ess, tss, r2 and mae.
+        '''
+        y_mean = self.sum_y / self.n
+        
+        # expand the squares, clip the tiny negatives rounding can leave
+        sse = max(self.sum_y2 - 2 * self.sum_y_yhat + self.sum_yhat2, 0.0)
+        ess = max(self.sum_yhat2 - 2 * y_mean * self.sum_yhat + self.n * y_mean ** 2, 0.0)
+        tss = max(self.sum_y2 - y_mean * self.sum_y, 0.0)
+        
+        return {'sse': sse, 'mse': sse / self.n, 'rmse': (sse / self.n) ** .5, 'ess': ess, 'tss': tss,
+                'r2': 1 - sse / tss, 'mae': self.sum_abs_error / self.n}
+
+    def hip_to_be_square(self):
+        '''
+        Returns sse, mse, rmse, ess, tss in the same order as hip_to_be_square.
+        '''
+        metrics = self.metrics()
+        
+        return tuple(metrics[name] for name in ('sse', 'mse', 'rmse', 'ess', 'tss'))
+
+
+def _accumulate_chunk(chunk):
+    y, yhat = chunk
+    return MetricAccumulator().update(y, yhat)
+
+
+def score_chunks(chunks, max_workers=None):
+    '''
+    Scores predictions that come in chunks, ex: a generator that reads properties_2017 a piece at a time and predicts it.
+    chunks: iterable of (y, yhat) pairs
+    max_workers: None scores the chunks one after the other in this process.
+    A number scores them on that many worker processes (only about 2 chunks per worker are in flight at once)
+    and merges the results.
+    Returns a MetricAccumulator, call .metrics() or .hip_to_be_square() on it.
+    '''
+    total = MetricAccumulator()
+    
+    if not max_workers:
+        for y, yhat in chunks:
+            total.update(y, yhat)
+        return total
+    
+    from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+    
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        running = set()
+        for chunk in chunks:
+            # don't read the whole generator ahead of the workers
+            if len(running) >= 2 * max_workers:
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    total.merge(future.result())
+            running.add(pool.submit(_accumulate_chunk, chunk))
+            
+        for future in running:
+            total.merge(future.result())
+            
+    return total
+
+################################################################################################
+
+def _bootstrap_shard(y, yhat, seed, size):
+    '''
+    Metrics for size bootstrap resamples of (y, yhat), drawn from seed (a numpy SeedSequence).
+    Every resample is a row of one index matrix. The index matrix is turned into a matrix of counts
+    (how many times each row was drawn) and one matrix product with the per row values gives the sums
+    every metric needs, for all the resamples at once.
+    Returns a dictionary of arrays, one value per resample.
+    '''
+    n = y.shape[0]
+    rng = np.random.default_rng(seed)
+    idx = rng.integers(0, n, size=(size, n))
+    # offset every resample into its own run of n, so one bincount counts them all
+    idx += np.arange(size)[:, None] * n
+    counts = np.bincount(idx.ravel(), minlength=size * n).reshape(size, n).astype(float)
+    
+    # center on the mean of y so the expanded squares don't lose precision (tss and ess don't change)
+    center = y.mean()
+    yc = y - center
+    yhatc = yhat - center
+    error = y - yhat
+    values = np.column_stack([yc, yc ** 2, yhatc, yhatc ** 2, error ** 2, np.abs(error)])
+    sum_y, sum_y2, sum_yhat, sum_yhat2, sse, sum_abs_error = (counts @ values).T
+    
+    y_mean = sum_y / n
+    tss = np.maximum(sum_y2 - n * y_mean ** 2, 0)
+    ess = np.maximum(sum_yhat2 - 2 * y_mean * sum_yhat + n * y_mean ** 2, 0)
+    
+    # baseline is the mean of each resample, so its sse is the resample's tss
+    return {'sse': sse, 'mse': sse / n, 'rmse': np.sqrt(sse / n), 'ess': ess, 'tss': tss,
+            'r2': 1 - sse / tss, 'mae': sum_abs_error / n,
+            'rmse_baseline': np.sqrt(tss / n), 'rmse_delta': np.sqrt(tss / n) - np.sqrt(sse / n)}
+
+
+def bootstrap_metrics(y, yhat, B=10_000, alpha=.05, seed=713, shard_size=500, max_workers=None):
+    '''
+    Bootstrap confidence intervals for the model metrics, and a paired comparison with the baseline 
+    (model and baseline are scored on the same resample every time).
+    y: actuals, yhat: predictions
+    B: number of resamples
+    alpha: intervals are the (alpha / 2, 1 - alpha / 2) percentiles. Default is 95% intervals
+    seed: same seed gives the same resamples, no matter how many workers
+    shard_size: resamples per shard (a shard needs about shard_size * len(y) * 16 bytes)
+    max_workers: None runs the shards one after the other in this process.
+    A number runs them on that many worker processes.
+    Returns a dictionary with:
+        summary: dataframe with the point estimate (hip_to_be_square and baseline_mean_errors on all the rows),
+                 lower and upper bound of every metric
+        samples: dataframe with the metrics of every resample
+        p_better: share of resamples where the model rmse is lower than the baseline rmse
+        better: True if the whole rmse_delta interval is above 0 (model beats baseline)
+    ex: boot = bootstrap_metrics(validate.taxvaluedollarcnt, validate.yhat_lm); boot['summary']
+    '''
+    y = np.asarray(y, dtype=float)
+    yhat = np.asarray(yhat, dtype=float)
+    
+    # one seed per shard, spawned from the main seed
+    sizes = [min(shard_size, B - start) for start in range(0, B, shard_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    
+    if not max_workers:
+        shards = [_bootstrap_shard(y, yhat, s, size) for s, size in zip(seeds, sizes)]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            shards = list(pool.map(_bootstrap_shard, [y] * len(sizes), [yhat] * len(sizes), seeds, sizes))
+            
+    samples = pd.DataFrame({name: np.concatenate([shard[name] for shard in shards]) for name in shards[0]})
+    
+    # point estimates from all the rows
+    sse, mse, rmse, ess, tss = hip_to_be_square(y, yhat)
+    sse_baseline, mse_baseline, rmse_baseline = baseline_mean_errors(y)
+    point = {'sse': sse, 'mse': mse, 'rmse': rmse, 'ess': ess, 'tss': tss,
+             'r2': 1 - sse / tss, 'mae': np.abs(y - yhat).mean(),
+             'rmse_baseline': rmse_baseline, 'rmse_delta': rmse_baseline - rmse}
+    
+    summary = pd.DataFrame({'estimate': pd.Series(point),
+                            'lower': samples.quantile(alpha / 2),
+                            'upper': samples.quantile(1 - alpha / 2)})
+    
+    return {'summary': summary,
+            'samples': samples,
+            'p_better': (samples.rmse_delta > 0).mean(),
+            'better': summary.loc['rmse_delta', 'lower'] > 0}
+
+################################################################################################
+
+def select_kbest(X, y, k, score_func=None):
     '''
     takes in the predictors (X), the target (y), and the number of features to select (k) 
     and returns the names (in a list) of the top k selected features based on the SelectKBest class
     Optional arg: score_func. Default is f_regression. other options ex: f_classif 
     '''
+    from sklearn.feature_selection import SelectKBest, f_regression
+
+    score_func = f_regression if score_func is None else score_func
+
     # create selector
     f_selector = SelectKBest(score_func=score_func, k=k)
     
@@ -135,14 +491,17 @@ def select_kbest(X, y, k, score_func=f_regression):
 
 ################################################################################################
 
-def rfe(X, y, n, estimator=LinearRegression()):
+def rfe(X, y, n, estimator=None):
     '''
     takes in the predictors (X), the target (y), and the number of features to select (n) 
     and returns the names (in a list) of the top k selected features based on the Recursive Feature Elimination class
-    Optional arg: estimator. Default is LinearRegression()
+    Optional arg: estimator. Default is a new LinearRegression()
     '''
-    # use the estimator model to create estimator
-    est = estimator
+    from sklearn.linear_model import LinearRegression
+    from sklearn.feature_selection import RFE
+
+    # use the estimator model to create estimator (a new one each call, so fits don't leak between calls)
+    est = LinearRegression() if estimator is None else estimator
     
     # set up with estimator and n_features
     rfe = RFE(estimator=est, n_features_to_select=n)
@@ -156,15 +515,349 @@ def rfe(X, y, n, estimator=LinearRegression()):
 
 ################################################################################################
 
+# (fingerprint, what was computed, settings) --> result. Shared by the feature selection functions below
+_selection_cache = {}
+
+def rfe_ranking(X, y, estimator=None, fingerprint=None):
+    '''
+    Runs Recursive Feature Elimination all the way down to 1 feature, once, and returns the ranking of every column
+    as a Series (1 = last one left, the best). The top n of this ranking is what rfe(X, y, n) picks,
+    so every n can be answered from one run. Cached by wrangle.values_fingerprint.
+    fingerprint: wrangle.values_fingerprint(X, y) if you already have it (hashing X goes through every row)
+    '''
+    from sklearn.linear_model import LinearRegression
+    from sklearn.feature_selection import RFE
+
+    est = LinearRegression() if estimator is None else estimator
+    fingerprint = w.values_fingerprint(X, y) if fingerprint is None else fingerprint
+    key = (fingerprint, 'rfe', repr(est))
+    
+    if key not in _selection_cache:
+        ranker = RFE(estimator=est, n_features_to_select=1)
+        ranker.fit(X, y)
+        _selection_cache[key] = pd.Series(ranker.ranking_, index=X.columns)
+        
+    return _selection_cache[key]
+
+
+def kbest_scores(X, y, score_func=None, fingerprint=None):
+    '''
+    Returns the SelectKBest score of every column as a Series, cached by wrangle.values_fingerprint.
+    score_func: default is f_regression
+    fingerprint: wrangle.values_fingerprint(X, y) if you already have it
+    '''
+    from sklearn.feature_selection import SelectKBest, f_regression
+
+    score_func = f_regression if score_func is None else score_func
+    fingerprint = w.values_fingerprint(X, y) if fingerprint is None else fingerprint
+    key = (fingerprint, 'kbest', score_func.__name__)
+    
+    if key not in _selection_cache:
+        _selection_cache[key] = pd.Series(SelectKBest(score_func=score_func, k='all').fit(X, y).scores_, index=X.columns)
+        
+    return _selection_cache[key]
+
+
+def selected_features(X, y, n, method='rfe', estimator=None, score_func=None, fingerprint=None):
+    '''
+    Returns the same list as rfe(X, y, n) (method='rfe') or select_kbest(X, y, n) (method='kbest'),
+    answered from the cached ranking or scores instead of a new fit.
+    fingerprint: wrangle.values_fingerprint(X, y) if you already have it, so looking up many n doesn't hash X every time
+    '''
+    if method == 'rfe':
+        ranking = rfe_ranking(X, y, estimator, fingerprint)
+        return list(X.columns[(ranking <= n).to_numpy()])
+    
+    if method == 'kbest':
+        scores = kbest_scores(X, y, score_func, fingerprint).to_numpy()
+        # same tie breaking as SelectKBest
+        mask = np.zeros(len(scores), dtype=bool)
+        mask[np.argsort(scores, kind='mergesort')[len(scores) - n:]] = True
+        return list(X.columns[mask])
+    
+    raise ValueError(f"method must be 'rfe' or 'kbest', not {method!r}")
+
+
+def _cv_rmse(X, y, cv, estimator):
+    from sklearn.model_selection import cross_val_score
+    
+    scores = cross_val_score(estimator, X, y, cv=cv, scoring='neg_root_mean_squared_error')
+    
+    return -scores.mean()
+
+
+def feature_search(X, y, ns=None, method='rfe', cv=5, max_workers=None, estimator=None, score_func=None):
+    '''
+    Sweeps the number of features. For every n in ns, picks the features with rfe or select_kbest
+    (method='rfe' or 'kbest', from one ranking/scoring run, see selected_features) and cross validates
+    the estimator on just those features.
+    ns: list of feature counts. Default is every count from 1 to the number of columns
+    cv: number of cross validation folds
+    max_workers: subsets are scored on a process pool with this many workers (None lets python pick)
+    estimator: model to select with and score. Default is LinearRegression()
+    Scores are cached by wrangle.values_fingerprint and the feature list, so re-running the sweep only fits new subsets.
+    Returns a dataframe with n, features and cv_rmse (mean RMSE over the folds), one row per n.
+    '''
+    from concurrent.futures import ProcessPoolExecutor
+    from sklearn.linear_model import LinearRegression
+    
+    est = LinearRegression() if estimator is None else estimator
+    ns = range(1, X.shape[1] + 1) if ns is None else ns
+    fingerprint = w.values_fingerprint(X, y)
+    
+    subsets = {n: selected_features(X, y, n, method, est, score_func, fingerprint) for n in ns}
+    keys = {n: (fingerprint, 'cv_rmse', tuple(features), cv, repr(est)) for n, features in subsets.items()}
+    
+    # only fit the subsets that aren't cached yet (different n can give the same subset)
+    todo = {keys[n]: subsets[n] for n in subsets if keys[n] not in _selection_cache}
+    
+    if todo:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            futures = {key: pool.submit(_cv_rmse, X[features], y, cv, est) for key, features in todo.items()}
+            for key, future in futures.items():
+                _selection_cache[key] = future.result()
+                
+    return pd.DataFrame({'n': list(subsets),
+                         'features': list(subsets.values()),
+                         'cv_rmse': [_selection_cache[keys[n]] for n in subsets]})
+
+################################################################################################
+
+def gram_sweep(X_train, y_train, X_validate, y_validate, max_features=None, min_features=1):
+    '''
+    Fits an ordinary least squares model (same as LinearRegression) for every subset of the columns of X_train,
+    without refitting. X'X and X'y are computed once on train (after centering, which takes care of the intercept),
+    and each subset is solved from the rows/columns of those matrices that belong to it.
+    Validate RMSE comes from the same kind of precomputed validate matrices, so no predictions are made either.
+    max_features, min_features: only try subsets with this many columns. Default is every size (2^columns - 1 subsets)
+    Returns a dataframe, one row per subset, sorted best validate RMSE first:
+    features, n_features, train_rmse, validate_rmse, validate_rmse_baseline, better_than_baseline, intercept, coef
+    Use sweep_predictions to get predictions for compare_rmse / better_than_baseline.
+    '''
+    from itertools import combinations
+    
+    cols = list(X_train.columns)
+    max_features = len(cols) if max_features is None else max_features
+    
+    X = X_train.to_numpy(dtype=float)
+    y = np.asarray(y_train, dtype=float)
+    x_mean = X.mean(axis=0)
+    y_mean = y.mean()
+    
+    # train Gram statistics, centered on the train means
+    X_c = X - x_mean
+    y_c = y - y_mean
+    gram, xty, yty = X_c.T @ X_c, X_c.T @ y_c, y_c @ y_c
+    
+    # validate Gram statistics, centered on the train means too (that's what the fitted model predicts around)
+    X_v = X_validate[cols].to_numpy(dtype=float) - x_mean
+    y_v = np.asarray(y_validate, dtype=float) - y_mean
+    gram_v, xty_v, yty_v = X_v.T @ X_v, X_v.T @ y_v, y_v @ y_v
+    
+    n, n_v = len(y), len(y_v)
+    
+    # baseline for validate is its own mean, like baseline_mean_errors(y_validate)
+    rmse_baseline = np.asarray(y_validate, dtype=float).std()
+    
+    rows = []
+    for k in range(min_features, max_features + 1):
+        for subset in combinations(range(len(cols)), k):
+            idx = list(subset)
+            block = np.ix_(idx, idx)
+            
+            # lstsq gives the same minimum norm answer LinearRegression does when columns are collinear
+            coef = np.linalg.lstsq(gram[block], xty[idx], rcond=None)[0]
+            
+            # SSE = y'y - 2 b'X'y + b'X'X b
+            sse = yty - 2 * coef @ xty[idx] + coef @ gram[block] @ coef
+            sse_v = yty_v - 2 * coef @ xty_v[idx] + coef @ gram_v[block] @ coef
+            
+            rmse_v = (max(sse_v, 0) / n_v) ** .5
+            rows.append({'features': [cols[i] for i in idx],
+                         'n_features': k,
+                         'train_rmse': (max(sse, 0) / n) ** .5,
+                         'validate_rmse': rmse_v,
+                         'validate_rmse_baseline': rmse_baseline,
+                         'better_than_baseline': rmse_v < rmse_baseline,
+                         'intercept': y_mean - x_mean[idx] @ coef,
+                         'coef': coef})
+            
+    return pd.DataFrame(rows).sort_values('validate_rmse', ignore_index=True)
+
+
+def sweep_predictions(sweep, X, y, top=5):
+    '''
+    Takes in the output of gram_sweep, predictors (X) and actuals (y) (ex: X_validate, y_validate)
+    and makes predictions for the top models in the sweep.
+    Returns a list of (predictions, actuals) tuples, ready for compare_rmse. Each predictions Series is named after its features.
+    ex: ev.compare_rmse(ev.sweep_predictions(sweep, X_validate, y_validate))
+    '''
+    pairs = []
+    
+    for _, row in sweep.head(top).iterrows():
+        yhat = pd.Series(X[row.features].to_numpy(dtype=float) @ row.coef + row.intercept,
+                         index=X.index, name=' + '.join(row.features))
+        pairs.append((yhat, y))
+        
+    return pairs
+
+################################################################################################
+
+def _share_array(values):
+    '''
+    Copies a 2d float64 array into a new block of shared memory.
+    Returns the SharedMemory (close and unlink it when done) and what a worker needs to attach: (name, shape).
+    '''
+    from multiprocessing import shared_memory
+    
+    values = np.ascontiguousarray(values, dtype=np.float64)
+    shm = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+    np.ndarray(values.shape, dtype=np.float64, buffer=shm.buf)[:] = values
+    
+    return shm, (shm.name, values.shape)
+
+
+def _fit_group(group, train, validate, estimator):
+    '''
+    Fits a copy of estimator on one group's rows and scores it on the group's validate rows.
+    train, validate: (shared memory name, shape, start, stop). The group's rows are start:stop of the shared array,
+    features in every column but the last, target in the last.
+    Only a view of the shared memory is used, the rows are never copied into this process.
+    Returns (group, fitted model, MetricAccumulator for validate).
+    '''
+    from multiprocessing import shared_memory
+    from sklearn.base import clone
+    
+    blocks = []
+    try:
+        views = []
+        for name, shape, start, stop in (train, validate):
+            shm = shared_memory.SharedMemory(name=name)
+            blocks.append(shm)
+            views.append(np.ndarray(shape, dtype=np.float64, buffer=shm.buf)[start:stop])
+        train_rows, validate_rows = views
+        
+        model = clone(estimator).fit(train_rows[:, :-1], train_rows[:, -1])
+        
+        accumulator = MetricAccumulator()
+        if len(validate_rows):
+            accumulator.update(validate_rows[:, -1], model.predict(validate_rows[:, :-1]))
+        
+        # drop the views before closing the shared memory under them
+        del views, train_rows, validate_rows
+    finally:
+        for shm in blocks:
+            shm.close()
+            
+    return group, model, accumulator
+
+
+def _group_slices(df, group, groups):
+    # sorts df's rows by group, returns the order and where each group starts and stops
+    codes = pd.Categorical(df[group], categories=groups).codes
+    order = np.argsort(codes, kind='stable')
+    bounds = np.searchsorted(codes[order], np.arange(len(groups) + 1))
+    
+    return order, {g: (bounds[i], bounds[i + 1]) for i, g in enumerate(groups)}
+
+
+def fit_by_group(train, validate, features, target='tax_value', group='county', estimator=None, groups=None,
+                 max_workers=None):
+    '''
+    Fits and scores a separate model for every group (ex: county or fips), each one on its own worker process.
+    The rows are sorted by group and put in shared memory once, so every worker reads its group's rows
+    in place instead of getting a pickled dataframe. Groups are collected as they finish, a slow group
+    doesn't hold up the others.
+    train, validate: wrangled dataframes
+    features: list of feature columns
+    estimator: model to fit (a fresh copy per group). Default is LinearRegression()
+    groups: only fit these groups (ex: refit just LA). Default is every group in train
+    max_workers: number of processes. Default lets python pick, 1 fits everything in this process
+    Returns a dictionary with:
+        models: group --> fitted model (see predict_by_group)
+        metrics: dataframe of validate metrics for every group, plus an 'all' row for all the groups together
+                 (the per group MetricAccumulators merged, same as hip_to_be_square on every row at once)
+    ex: fits = fit_by_group(train, validate, ['sqft_calculated', 'bedroom_cnt', 'bathroom_cnt'])
+    '''
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from sklearn.linear_model import LinearRegression
+    
+    estimator = LinearRegression() if estimator is None else estimator
+    groups = list(pd.unique(train[group])) if groups is None else list(groups)
+    columns = list(features) + [target]
+    
+    train_order, train_slices = _group_slices(train, group, groups)
+    validate_order, validate_slices = _group_slices(validate, group, groups)
+    
+    shared = []
+    results = {}
+    try:
+        train_shm, (train_name, train_shape) = _share_array(train[columns].to_numpy()[train_order])
+        shared.append(train_shm)
+        validate_shm, (validate_name, validate_shape) = _share_array(validate[columns].to_numpy()[validate_order])
+        shared.append(validate_shm)
+        
+        jobs = [(g, (train_name, train_shape) + train_slices[g], (validate_name, validate_shape) + validate_slices[g])
+                for g in groups]
+        
+        if max_workers == 1:
+            for g, train_job, validate_job in jobs:
+                g, model, accumulator = _fit_group(g, train_job, validate_job, estimator)
+                results[g] = (model, accumulator)
+        else:
+            with ProcessPoolExecutor(max_workers=max_workers) as pool:
+                futures = [pool.submit(_fit_group, g, train_job, validate_job, estimator)
+                           for g, train_job, validate_job in jobs]
+                for future in as_completed(futures):
+                    g, model, accumulator = future.result()
+                    results[g] = (model, accumulator)
+    finally:
+        for shm in shared:
+            shm.close()
+            shm.unlink()
+            
+    # per group metrics, then every group together
+    rows = {}
+    total = MetricAccumulator()
+    for g in groups:
+        accumulator = results[g][1]
+        rows[g] = {'n': accumulator.n, **accumulator.metrics()} if accumulator.n else {'n': 0}
+        total.merge(accumulator)
+    rows['all'] = {'n': total.n, **total.metrics()}
+    
+    return {'models': {g: results[g][0] for g in groups},
+            'metrics': pd.DataFrame.from_dict(rows, orient='index')}
+
+
+def predict_by_group(models, df, features, group='county'):
+    '''
+    Predicts every row of df with its group's model (models from fit_by_group).
+    Returns a Series lined up with df, NaN for rows whose group has no model.
+    '''
+    yhat = pd.Series(np.nan, index=df.index)
+    
+    for g, model in models.items():
+        rows = (df[group] == g).to_numpy()
+        if rows.any():
+            yhat[rows] = model.predict(df.loc[rows, features].to_numpy(dtype=float))
+            
+    return yhat
+
+################################################################################################
+
 # maybe in the future add creating the preditions and the residuals if none were entered 
 # have to import sklearn stuff
 
-def plot_the_dots(actuals, predictions, residuals):
+def plot_the_dots(actuals, predictions, residuals, max_points = None):
     '''
     This function takes in the actuals (i.e. df.actuals), predictions, and residuals and outputs two graphs.
     One to see the regression line and the actuals/predictions
     One to see the actuals vs the residuals.
+    Optional arg max_points: above this many rows the scatter plots become hexbin density plots
+    (default explore.max_plot_points)
     '''
+    import matplotlib.pyplot as plt
+    from sklearn.metrics import r2_score, mean_squared_error
     
     r_sq = r2_score(actuals, predictions)
     rmse = mean_squared_error(actuals, predictions, squared = False)
@@ -174,16 +867,19 @@ def plot_the_dots(actuals, predictions, residuals):
     # plots actual vs predicted
     plt.figure(figsize=(16, 7))
     ax = plt.subplot(1, 2, 1)
-    ax.scatter(actuals, predictions, label='predicted')
+    ex.scatter_density(ax, actuals, predictions, max_points, label='predicted')
     ax.set(title='Actual vs Predicted Value', ylabel='Prediction', xlabel='Actual')
-    ax.plot(actuals, actuals, ls=':', c='gray')
+    
+    # the line only needs its two ends
+    ends = [actuals.min(), actuals.max()]
+    ax.plot(ends, ends, ls=':', c='gray')
     ax.text(text_loc, 1, f'R^2: {r_sq:.2f}', fontsize='large')
     
     #put r^2 value on graph
     # and rmse and rmse of baseline
     
     ax = plt.subplot(1, 2, 2)
-    ax.scatter(actuals, residuals)
+    ex.scatter_density(ax, actuals, residuals, max_points)
     ax.set(title = 'Actual vs Residual',ylabel='Residual', xlabel='Actual')
     ax.hlines(0, *ax.get_xlim(), ls=':', color='gray')
     ax.text(text_loc, -3, f'RMSE: {rmse:.2f}')
@@ -195,6 +891,8 @@ def compare_rmse(pred_actuals):
     This function takes in a list of tuples ex [(df.pred1, df.actuals), (df.pred2, y_validate)]
     unpacks the tuple, and prints out the Root Mean Squared Error for each 
     '''
+    from sklearn.metrics import mean_squared_error
+
     for prediction, actual in pred_actuals:
         rmse = mean_squared_error(prediction, actual, squared = False)
         print(f'RMSE for {prediction.name}: {rmse} ')
\ No newline at end of file
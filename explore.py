@@ -1,9 +1,70 @@
 import pandas as pd
 import numpy as np
-import seaborn as sns
-import matplotlib.pyplot as plt
+# seaborn and matplotlib are imported in the functions that draw, so importing explore stays quick
 from itertools import combinations
+import os
+import json
 
+import wrangle as w
+
+
+
+############################## size aware plotting ############################# 
+
+# above this many rows scatter plots switch to a hexbin density plot
+# (box plots, violin plots and regression lines always use every row)
+max_plot_points = 5_000
+
+# swarm plot layout time grows about with the square of the points, so they get a smaller stratified sample
+max_swarm_points = 1_000
+
+# columns the samples keep the mix of (the ones that are in the dataframe)
+plot_strata = ('county', 'has_pool', 'has_garage')
+
+
+def stratified_sample(df, by = plot_strata, n = None, seed = 713):
+    '''
+    Returns about n rows of df (default max_plot_points), taking the same share of every group of the by columns,
+    and at least 1 row from every group so small groups still show up. Columns in by that df doesn't have are skipped.
+    Returns df as is if it has n rows or less.
+    '''
+    n = max_plot_points if n is None else n
+    if len(df) <= n:
+        return df
+    
+    by = [col for col in dict.fromkeys(by) if col in df.columns]
+    if not by:
+        return df.sample(n, random_state = seed)
+    
+    frac = n / len(df)
+    parts = [group.sample(max(1, round(len(group) * frac)), random_state = seed)
+             for _, group in df.groupby(by[0] if len(by) == 1 else by, observed = True)]
+    return pd.concat(parts)
+
+
+def scatter_density(ax, x, y, max_points = None, gridsize = 50, **scatter_kws):
+    '''
+    Scatter plot of x and y on ax, or a hexbin density plot of every point when there are more than
+    max_points (default max_plot_points), so drawing time doesn't grow with the data.
+    scatter_kws: passed to ax.scatter (ex: color, label)
+    '''
+    max_points = max_plot_points if max_points is None else max_points
+    
+    if len(x) <= max_points:
+        return ax.scatter(x, y, **scatter_kws)
+    
+    return ax.hexbin(x, y, gridsize = gridsize, mincnt = 1, bins = 'log', cmap = 'Blues')
+
+
+def _new_figure(fig = None, figsize = None):
+    # a new pyplot figure (so plt.show shows it), or fig sized to figsize.
+    # render_plots passes a plain matplotlib.figure.Figure, which never touches pyplot or its backend
+    if fig is None:
+        import matplotlib.pyplot as plt
+        return plt.figure(figsize = figsize)
+    if figsize is not None:
+        fig.set_size_inches(figsize)
+    return fig
 
 
 ############################## plotting variable pairs for continous vars ############################# 
@@ -19,6 +80,8 @@ def plot_variable_pairs(df, cont_vars, dot_color = 'tab:blue', line_color = 'ora
     This function takes in a dataframe and a list of continous variables
     Plots them pairwise (only one plot for each relationship), with a regression line on a scatter plot
     '''
+    import matplotlib.pyplot as plt
+
     # get combinations of all variables in list
     combos = combinations(cont_vars,2)
     
@@ -29,10 +92,35 @@ def plot_variable_pairs(df, cont_vars, dot_color = 'tab:blue', line_color = 'ora
         x, y = combo
         
         # plot each one using the data from the inputted dataframe. use dot color and line color
-        sns.regplot(x = x, y = y, data=df, scatter_kws = {'color': dot_color}, line_kws = {'color': line_color})
+        draw_variable_pair(df, x, y, dot_color, line_color)
         plt.show()
 
 
+def draw_variable_pair(df, x, y, dot_color = 'tab:blue', line_color = 'orange', fig = None):
+    '''
+    Draws one plot for plot_variable_pairs (scatter plot of x and y with a regression line) on a new figure.
+    fig: figure to draw on instead (ex: a matplotlib.figure.Figure, see render_plots)
+    Returns the figure.
+    '''
+    import seaborn as sns
+
+    fig = _new_figure(fig)
+    ax = fig.gca()
+    
+    if len(df) <= max_plot_points:
+        sns.regplot(x = x, y = y, data=df, scatter_kws = {'color': dot_color}, line_kws = {'color': line_color}, ax = ax)
+        return fig
+    
+    # big data: density of every point, regression line fit on every point
+    data = df[[x, y]].dropna()
+    scatter_density(ax, data[x], data[y])
+    slope, intercept = np.polyfit(data[x], data[y], 1)
+    ends = np.array([data[x].min(), data[x].max()])
+    ax.plot(ends, slope * ends + intercept, color = line_color)
+    ax.set(xlabel = x, ylabel = y)
+    return fig
+
+
 
 ############################## plot the cat and continous variables ##############################
 
@@ -41,6 +129,8 @@ def plot_cat_and_cont(df, cat_vars, cont_vars):
     df = dataframe you're graphing
     This function takes in a list of categorical variables and continous variable and plots a swarm plot, box plot, and violin plot for each pair
     '''
+    import matplotlib.pyplot as plt
+
     # multiply length of continuous variables and length of categorical variables. This is the amount of rows in subplot, and helps set figsize to be tall enough
     num_graphs = len(cont_vars) * len(cat_vars)
     
@@ -58,14 +148,7 @@ def plot_cat_and_cont(df, cat_vars, cont_vars):
             
             # plot all three plots (can change which ones you would like to use here)
             # [row] is the row number we're on, [0] is left most graph in subplot
-            sns.swarmplot(x=cat, y=cont, data=df, ax = axes[row][0])
-            axes[row][0].set_title(f'{cat} and {cont}')
-            
-            sns.boxplot(x=cat, y=cont, data=df, ax = axes[row][1])
-            axes[row][1].set_title(f'{cat} and {cont}')
-            
-            sns.violinplot(x = cat, y = cont, data =df, ax = axes[row][2])
-            axes[row][2].set_title(f'{cat} and {cont}')
+            _draw_cat_and_cont_row(df, cat, cont, axes[row])
         
             # add one to row to move to next row for the next round
             row = row + 1
@@ -75,53 +158,467 @@ def plot_cat_and_cont(df, cat_vars, cont_vars):
     # show it all
     plt.show()
 
+
+def _draw_cat_and_cont_row(df, cat, cont, axes):
+    # swarm, box and violin plot of one categorical and continuous pair, on 3 axes
+    import seaborn as sns
+
+    # swarm plots lay out every point (slow on big data), so they get a stratified sample
+    sns.swarmplot(x=cat, y=cont, data=stratified_sample(df, (cat,) + plot_strata, max_swarm_points), ax = axes[0])
+    axes[0].set_title(f'{cat} and {cont}')
+    
+    sns.boxplot(x=cat, y=cont, data=df, ax = axes[1])
+    axes[1].set_title(f'{cat} and {cont}')
+    
+    sns.violinplot(x = cat, y = cont, data =df, ax = axes[2])
+    axes[2].set_title(f'{cat} and {cont}')
+
+
+def draw_cat_and_cont(df, cat, cont, fig = None):
+    '''
+    Draws one row of plot_cat_and_cont (swarm plot, box plot and violin plot of cont for each value of cat)
+    on a new figure. fig: figure to draw on instead (see render_plots). Returns the figure.
+    '''
+    fig = _new_figure(fig, (20, 5))
+    _draw_cat_and_cont_row(df, cat, cont, fig.subplots(1, 3))
+    return fig
+
+############################## Precomputed Summaries ##############################
+
+# (wrangle.values_fingerprint of the column, bins, kde_points) --> summary, so the same column is only summarized once.
+# Summaries hold the fliers, so only the most recently used summary_cache_size of them are kept
+_summary_cache = {}
+summary_cache_size = 64
+
+
+def _cached_summary(key):
+    # the cached summary for key (None if there isn't one), moved to the end as the most recently used
+    summary = _summary_cache.pop(key, None)
+    if summary is not None:
+        _summary_cache[key] = summary
+    return summary
+
+
+def _cache_summary(key, summary):
+    # dictionaries keep insertion order, so the first keys are the least recently used
+    _summary_cache[key] = summary
+    while len(_summary_cache) > summary_cache_size:
+        del _summary_cache[next(iter(_summary_cache))]
+
+
+def kde_from_counts(counts, bin_width, bandwidth):
+    '''
+    Gaussian kernel density estimate from binned counts (a binned KDE): the counts are convolved with a Gaussian
+    kernel using an FFT, instead of adding up one kernel per data point.
+    counts: 1d array of counts on equal width bins, or 2d with one row per variable (same number of bins each)
+    bin_width: width of the bins, one number or one per row
+    bandwidth: kernel standard deviation in data units, one number or one per row
+    Returns the density at the bin centers, same shape as counts (each row integrates to 1).
+    '''
+    counts = np.asarray(counts, dtype = float)
+    rows = np.atleast_2d(counts)
+    n_bins = rows.shape[1]
+
+    # bandwidth in bins, one per row
+    width = np.broadcast_to(np.asarray(bin_width, dtype = float), (len(rows),))[:, None]
+    bw = np.broadcast_to(np.asarray(bandwidth, dtype = float), (len(rows),))[:, None] / width
+
+    # kernel out to 4 bandwidths (or the whole grid), normalized so it sums to 1 in bins
+    reach = int(min(n_bins - 1, np.ceil(4 * bw.max())))
+    offsets = np.arange(-reach, reach + 1)
+    kernel = np.exp(-0.5 * (offsets / bw) ** 2)
+    kernel /= kernel.sum(axis = 1, keepdims = True)
+
+    # zero padded FFT convolution of every row at once
+    size = n_bins + 2 * reach
+    smoothed = np.fft.irfft(np.fft.rfft(rows, size) * np.fft.rfft(kernel, size), size)[:, reach:reach + n_bins]
+
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        density = np.clip(smoothed, 0, None) / (rows.sum(axis = 1, keepdims = True) * width)
+
+    return density.reshape(counts.shape)
+
+
+def _scott_bandwidth(n, std):
+    # Scott's rule, what scipy's gaussian_kde (and so seaborn) uses by default
+    return std * n ** (-1 / 5)
+
+
+def _summary(quantiles, hist_counts, hist_edges, kde_counts, kde_edges, std, whislo, whishi, fliers):
+    # one column's summary from its pieces
+    n = int(hist_counts.sum())
+    has_kde = n > 1 and std > 0
+
+    return {'n': n,
+            'min': quantiles[0], 'q1': quantiles[1], 'median': quantiles[2], 'q3': quantiles[3], 'max': quantiles[4],
+            'whislo': whislo, 'whishi': whishi, 'fliers': fliers,
+            'hist_counts': hist_counts, 'hist_edges': hist_edges,
+            'kde_x': (kde_edges[:-1] + kde_edges[1:]) / 2 if has_kde else np.empty(0),
+            'kde_density': (kde_from_counts(kde_counts, kde_edges[1] - kde_edges[0], _scott_bandwidth(n, std))
+                            if has_kde else np.empty(0))}
+
+
+def summarize_columns(df, bins = 'auto', kde_points = 512):
+    '''
+    Works out everything the distribution and box plots need for every numeric column of df, in one go:
+    quartiles, whiskers and fliers (same as a box plot), histogram counts and a KDE curve.
+    Results are cached by a fingerprint of each column's values, so drawing the same column again
+    (ex: after changing the style) doesn't go back to the data.
+    bins: histogram bins, anything np.histogram_bin_edges takes. Default 'auto'
+    kde_points: number of points on the KDE curve
+    Returns a dictionary of column name --> summary dictionary. Columns that aren't numbers or booleans
+    (ex: county, transaction_date) have no summary, the plots draw those straight from the data with seaborn.
+    '''
+    summaries = {}
+    todo = {}
+    # bins can be an array of edges, which can't go in a dictionary key as is
+    bins_key = tuple(np.atleast_1d(bins).tolist())
+
+    for col in df.select_dtypes(include = ['number', 'bool']).columns:
+        values = df[col].to_numpy(dtype = float)
+        key = (w.values_fingerprint(values), bins_key, kde_points)
+        summary = _cached_summary(key)
+        if summary is not None:
+            summaries[col] = summary
+        else:
+            todo[col] = (key, values)
+
+    if todo:
+        # one block of the columns that still need summaries, quartiles for all of them in one call
+        block = np.column_stack([values for _, values in todo.values()])
+        quantiles = np.nanquantile(block, [0, .25, .5, .75, 1], axis = 0)
+        stds = np.nanstd(block, axis = 0, ddof = 1)
+
+        # box plot whiskers reach the furthest point within 1.5 IQR of the box
+        low = quantiles[1] - 1.5 * (quantiles[3] - quantiles[1])
+        high = quantiles[3] + 1.5 * (quantiles[3] - quantiles[1])
+        with np.errstate(invalid = 'ignore'):
+            whislo = np.where(block >= low, block, np.inf).min(axis = 0)
+            whishi = np.where(block <= high, block, -np.inf).max(axis = 0)
+
+        for i, (col, (key, values)) in enumerate(todo.items()):
+            values = values[~np.isnan(values)]
+            hist_counts, hist_edges = np.histogram(values, bins = bins)
+            kde_counts, kde_edges = np.histogram(values, bins = kde_points)
+            fliers = values[(values < low[i]) | (values > high[i])]
+
+            summaries[col] = _summary(quantiles[:, i], hist_counts, hist_edges, kde_counts, kde_edges,
+                                      stds[i], whislo[i], whishi[i], fliers)
+            _cache_summary(key, summaries[col])
+
+    return {col: summaries[col] for col in df.columns if col in summaries}
+
+
+def summarize_chunks(chunks, columns, bins = 50, kde_points = 512):
+    '''
+    Same summaries as summarize_columns, for data that comes in chunks and doesn't fit in memory.
+    chunks: a function that returns a new iterable of dataframe chunks each time it's called, or a list of dataframes
+    (not a generator or iterator, since those can only be read once).
+    The data is read three times: count, min, max and std first, then histogram counts (quartiles come from a
+    fine histogram, so they are accurate to about (max - min) / 4096), then whiskers and fliers.
+    bins: number of histogram bins (a number, since the edges have to be known before the data is seen)
+    Returns a dictionary of column name --> summary dictionary (not cached).
+    '''
+    get_chunks = w._rereadable_chunks(chunks)
+    columns = list(columns)
+    fine_bins = 4096
+
+    # pass 1: min, max, and count, mean and spread (wrangle.RunningMoments, one per column since each
+    # column has its own NaNs)
+    moments = [w.RunningMoments() for _ in columns]
+    lo = np.full(len(columns), np.inf)
+    hi = np.full(len(columns), -np.inf)
+    for chunk in get_chunks():
+        block = chunk[columns].to_numpy(dtype = float)
+        for i, col_moments in enumerate(moments):
+            col_moments.update(block[~np.isnan(block[:, i]), i])
+        lo = np.fmin(lo, np.nanmin(block, axis = 0, initial = np.inf))
+        hi = np.fmax(hi, np.nanmax(block, axis = 0, initial = -np.inf))
+    # sample std (ddof=1) like summarize_columns
+    stds = np.array([np.sqrt(m.m2[0] / (m.n - 1)) if m.n > 1 else np.nan for m in moments])
+
+    # pass 2: histograms on edges that are known now (display bins, kde bins, fine bins for the quartiles)
+    edges = {col: [np.histogram_bin_edges([lo[i], hi[i]], count) for count in (bins, kde_points, fine_bins)]
+             for i, col in enumerate(columns)}
+    counts = {col: [np.zeros(len(e) - 1) for e in edges[col]] for col in columns}
+    for chunk in get_chunks():
+        for col in columns:
+            values = chunk[col].to_numpy(dtype = float)
+            values = values[~np.isnan(values)]
+            for col_counts, col_edges in zip(counts[col], edges[col]):
+                col_counts += np.histogram(values, bins = col_edges)[0]
+
+    # quartiles from the fine histogram, interpolating inside the bin
+    quantiles = {}
+    for i, col in enumerate(columns):
+        cum = np.concatenate([[0], np.cumsum(counts[col][2])])
+        quartiles = np.interp(np.array([.25, .5, .75]) * cum[-1], cum, edges[col][2])
+        quantiles[col] = np.concatenate([[lo[i]], quartiles, [hi[i]]])
+
+    # pass 3: whiskers and fliers
+    whislo = {col: np.inf for col in columns}
+    whishi = {col: -np.inf for col in columns}
+    fliers = {col: [] for col in columns}
+    for chunk in get_chunks():
+        for col in columns:
+            values = chunk[col].to_numpy(dtype = float)
+            values = values[~np.isnan(values)]
+            q1, q3 = quantiles[col][1], quantiles[col][3]
+            inside = (values >= q1 - 1.5 * (q3 - q1)) & (values <= q3 + 1.5 * (q3 - q1))
+            if inside.any():
+                whislo[col] = min(whislo[col], values[inside].min())
+                whishi[col] = max(whishi[col], values[inside].max())
+            fliers[col].append(values[~inside])
+
+    return {col: _summary(quantiles[col], counts[col][0].astype(int), edges[col][0], counts[col][1], edges[col][1],
+                          stds[i], whislo[col], whishi[col], np.concatenate(fliers[col]))
+            for i, col in enumerate(columns)}
+
+
+def _draw_hist(ax, summary, color = 'tab:blue'):
+    # histogram and kde line from a summary, the kde is scaled to counts like seaborn's histplot(kde=True)
+    ax.stairs(summary['hist_counts'], summary['hist_edges'], fill = True, color = color, alpha = .5)
+    ax.stairs(summary['hist_counts'], summary['hist_edges'], color = color, lw = .5)
+    if len(summary['kde_x']):
+        bin_width = np.diff(summary['hist_edges']).mean()
+        ax.plot(summary['kde_x'], summary['kde_density'] * summary['n'] * bin_width, color = color)
+    ax.set_ylabel('Count')
+
+
+def _draw_box(ax, summary, vert = False):
+    # box plot from a summary
+    stats = {key: summary[key] for key in ('q1', 'q3', 'whislo', 'whishi', 'fliers')}
+    stats['med'] = summary['median']
+    ax.bxp([stats], vert = vert, patch_artist = True,
+           boxprops = {'facecolor': 'tab:blue', 'alpha': .7}, medianprops = {'color': 'black'})
+    if vert:
+        ax.set_xticks([])
+    else:
+        ax.set_yticks([])
+
+
+def _seaborn_box(ax, df, col, vert = False):
+    # box plot of a column with no summary, the way the plots drew every column before the summaries.
+    # Newer seaborn only boxes numbers, for anything else (ex: county) the axes just say so
+    import seaborn as sns
+
+    try:
+        if vert:
+            sns.boxplot(y = col, data = df, ax = ax)
+        else:
+            sns.boxplot(data = df, x = col, ax = ax)
+    except TypeError:
+        ax.text(.5, .5, f'{col} is not numeric', ha = 'center', va = 'center')
+        ax.set_axis_off()
+
+
 ############################## Plot Distribution of Variables ##############################
 
-def plot_variable_dist(df, figsize = (3,2)):
+def plot_variable_dist(df, figsize = (3,2), summaries = None):
     '''
     This function is for exploring. Takes in a dataframe with variables you would like to see the distribution of.
     Input the dataframe (either fully, or using .drop) with ONLY the columns you want to see plotted.
-    Optional arguement figsize. Default it's small. 
+    Optional arguement figsize. Default it's small.
     BTW if you just put list(df) it pulls out only the column names
+    Optional arguement summaries: from summarize_columns or summarize_chunks. Default is to make them from df
     '''
-    # loop through columns and use seaborn to plot distributions
-    for col in list(df):
-        plt.figure(figsize=figsize)
-        sns.histplot(data = df, x = col, kde=True)
-        plt.title(f'Distribution of {col}')
+    import matplotlib.pyplot as plt
+
+    summaries = summarize_columns(df) if summaries is None else summaries
+
+    # loop through columns and plot distributions from the summaries (without df, the columns that have summaries)
+    for col in (summaries if df is None else list(df)):
+        draw_variable_dist(df, col, figsize, summaries.get(col))
         plt.show()
 
+
+def draw_variable_dist(df, col, figsize = (3,2), summary = None, fig = None):
+    '''
+    Draws one plot for plot_variable_dist (histogram with kde of col) on a new figure. Returns the figure.
+    summary: the summary of col (see summarize_columns). Default is to make it from df
+    fig: figure to draw on instead (see render_plots)
+    '''
+    summary = summarize_columns(df[[col]]).get(col) if summary is None else summary
+
+    fig = _new_figure(fig, figsize)
+    ax = fig.gca()
+    if summary is None:
+        # not a number (ex: county), seaborn draws it from the data
+        import seaborn as sns
+        sns.histplot(data = df, x = col, kde=True, ax = ax)
+    else:
+        _draw_hist(ax, summary)
+        ax.set_xlabel(col)
+    ax.set_title(f'Distribution of {col}')
+    return fig
+
 ############################## Plot Box Plots for all Variables ##############################
 
-def plot_boxes(df, figsize = (4,2)):
+def plot_boxes(df, figsize = (4,2), summaries = None):
     '''
     This function is for exploring. Takes in a dataframe with variables you would like to see the box plot of.
     Input the dataframe (either fully, or using .drop) with ONLY the columns you want to see plotted.
-    Optional arguement figsize. Default it's small.    
+    Optional arguement figsize. Default it's small.
+    Optional arguement summaries: from summarize_columns or summarize_chunks. Default is to make them from df
     '''
+    import matplotlib.pyplot as plt
 
-    for col in list(df):
-        plt.figure(figsize=figsize)
-        sns.boxplot(data = df, x = col)
-        plt.title(f'Box Plot of {col}')
+    summaries = summarize_columns(df) if summaries is None else summaries
+
+    # every column of df (without df, the columns that have summaries)
+    for col in (summaries if df is None else list(df)):
+        draw_box(df, col, figsize, summaries.get(col))
         plt.show()
 
+
+def draw_box(df, col, figsize = (4,2), summary = None, fig = None):
+    '''
+    Draws one plot for plot_boxes (box plot of col) on a new figure. Returns the figure.
+    summary: the summary of col (see summarize_columns). Default is to make it from df
+    fig: figure to draw on instead (see render_plots)
+    '''
+    summary = summarize_columns(df[[col]]).get(col) if summary is None else summary
+
+    fig = _new_figure(fig, figsize)
+    ax = fig.gca()
+    if summary is None:
+        # not a number (ex: county), seaborn draws it from the data
+        _seaborn_box(ax, df, col)
+    else:
+        _draw_box(ax, summary)
+        ax.set_xlabel(col)
+    ax.set_title(f'Box Plot of {col}')
+    return fig
+
 ############################## Explore Univariate ##############################
 
-def explore_univariate(df, figsize = (18,3)):
+def explore_univariate(df, figsize = (18,3), summaries = None):
     '''
     This function is for exploring. Takes in a dataframe with variables you would like to see the box plot of.
     Input the dataframe (either fully, or using .drop) with ONLY the columns you want to see plotted.
-    Optional arguement figsize. Default it's small.    
+    Optional arguement figsize. Default it's small.
+    Optional arguement summaries: from summarize_columns or summarize_chunks. Default is to make them from df
+    '''
+    import matplotlib.pyplot as plt
+
+    summaries = summarize_columns(df) if summaries is None else summaries
+
+    # every column of df (without df, the columns that have summaries)
+    for col in (summaries if df is None else list(df)):
+        draw_univariate(df, col, figsize, summaries.get(col))
+        plt.show()
+
+
+def draw_univariate(df, col, figsize = (18,3), summary = None, fig = None):
+    '''
+    Draws one plot for explore_univariate (box plot and histogram of col side by side) on a new figure.
+    Both come from the same summary, so the column is only gone through once.
+    fig: figure to draw on instead (see render_plots)
+    Returns the figure.
+    '''
+    summary = summarize_columns(df[[col]]).get(col) if summary is None else summary
+
+    fig = _new_figure(fig, figsize)
+    box_ax, hist_ax = fig.add_subplot(121), fig.add_subplot(122)
+    if summary is None:
+        # not a number (ex: county), seaborn draws both from the data
+        import seaborn as sns
+        _seaborn_box(box_ax, df, col, vert = True)
+        sns.histplot(data = df, x = col, kde=True, ax = hist_ax)
+    else:
+        _draw_box(box_ax, summary, vert = True)
+        box_ax.set_ylabel(col)
+        _draw_hist(hist_ax, summary)
+        hist_ax.set_xlabel(col)
+
+    box_ax.set_title(f'Box Plot of {col}')
+    hist_ax.set_title(f'Distribution of {col}')
+    return fig
+
+
+############################## Batch Rendering ##############################
+
+# plot kind --> (draw function, names of the column arguments it takes)
+plot_kinds = {
+    'variable_pair': (draw_variable_pair, ('x', 'y')),
+    'cat_and_cont': (draw_cat_and_cont, ('cat', 'cont')),
+    'variable_dist': (draw_variable_dist, ('col',)),
+    'box': (draw_box, ('col',)),
+    'univariate': (draw_univariate, ('col',)),
+}
+
+
+def plot_jobs(cont_vars, cat_vars = (), kinds = ('variable_pair', 'cat_and_cont', 'variable_dist', 'box', 'univariate')):
+    '''
+    Makes the list of figures an EDA report is made of: every figure plot_variable_pairs, plot_cat_and_cont,
+    plot_variable_dist, plot_boxes and explore_univariate would draw for these variables.
+    Returns a list of (kind, {argument: column}) tuples for render_plots.
     '''
+    jobs = []
+    for kind in kinds:
+        if kind == 'variable_pair':
+            jobs += [(kind, {'x': x, 'y': y}) for x, y in combinations(cont_vars, 2)]
+        elif kind == 'cat_and_cont':
+            jobs += [(kind, {'cat': cat, 'cont': cont}) for cont in cont_vars for cat in cat_vars]
+        elif kind in plot_kinds:
+            jobs += [(kind, {'col': col}) for col in cont_vars]
+        else:
+            raise ValueError(f'Unknown plot kind {kind!r}. Options are: {sorted(plot_kinds)}')
+    return jobs
+
+
+# the dataframe each render worker draws from, sent once per worker instead of once per figure
+_render_df = None
 
-    for col in list(df):
-        plt.figure(figsize=figsize)
-        plt.subplot(121)
-        sns.boxplot(y = col, data = df)
-        plt.title(f'Box Plot of {col}')
+def _init_render_worker(df):
+    global _render_df
+    _render_df = df
+
+
+def _render_job(job, out_dir, fmt):
+    # each figure is a plain Figure on an Agg canvas, so pyplot (and whatever backend it's using) is never touched
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    kind, args = job
+    draw, _ = plot_kinds[kind]
+    
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    draw(_render_df, **args, fig = fig)
+    
+    path = os.path.join(out_dir, f"{kind}__{'__'.join(map(str, args.values()))}.{fmt}")
+    fig.savefig(path, bbox_inches = 'tight')
+    
+    return {'kind': kind, **args, 'path': path}
 
-        plt.subplot(122)
-        sns.histplot(data = df, x = col, kde=True)
-        plt.title(f'Distribution of {col}')
-        plt.show()
\ No newline at end of file
+def render_plots(df, jobs, out_dir = 'eda_report', fmt = 'png', max_workers = None):
+    '''
+    Draws figures without showing them (on an Agg canvas, pyplot's backend and open figures are left alone)
+    and saves each one to out_dir, spread over a process pool.
+    Use it for EDA reports that run on their own, ex: on a fresh Zillow pull every night.
+    df: dataframe to plot
+    jobs: list of figures to draw, from plot_jobs
+    fmt: 'png' or 'svg' (anything matplotlib can save)
+    max_workers: number of processes. Default lets python pick, 1 draws everything in this process
+    Returns the manifest: a list of dictionaries with the kind of plot, its columns and the file path,
+    also saved to out_dir/manifest.json.
+    ex: render_plots(train, plot_jobs(['sqft_calculated', 'tax_value'], ['county']))
+    '''
+    from functools import partial
+    from concurrent.futures import ProcessPoolExecutor
+    
+    os.makedirs(out_dir, exist_ok = True)
+    render = partial(_render_job, out_dir = out_dir, fmt = fmt)
+    
+    if max_workers == 1:
+        _init_render_worker(df)
+        manifest = [render(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers = max_workers, initializer = _init_render_worker, initargs = (df,)) as pool:
+            manifest = list(pool.map(render, jobs))
+    
+    with open(os.path.join(out_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent = 2)
+    
+    return manifest
\ No newline at end of file
@@ -0,0 +1,443 @@
+# Prediction functions
+
+
+################ Imports ################
+import sys
+import json
+import time
+import queue
+import threading
+
+import pandas as pd
+import numpy as np
+
+import wrangle as w
+
+
+#################################### Model bundles ####################################
+
+def scaling_from_train(train, col_names, scaler_name):
+    '''
+    Works out the scaling of each column from train, after my_scaler or scale_columns added the scaled
+    columns (named {col}_{scaler_name}). my_scaler refits the same scaler for every column, so the scaler
+    it returns only remembers the last column. This gets every column back from the data instead.
+    Only works for scalers that scale each column in a straight line (MinMaxScaler, StandardScaler, RobustScaler).
+    Returns a dataframe with one row per column: scale and offset, so that scaled = value * scale + offset
+    (the same thing scaler_params returns).
+    '''
+    rows = {}
+
+    for col in col_names:
+        values = train[col].to_numpy(dtype=float)
+        scaled = train[f'{col}_{scaler_name}'].to_numpy(dtype=float)
+        keep = ~(np.isnan(values) | np.isnan(scaled))
+        values, scaled = values[keep], scaled[keep]
+
+        # two rows with different values are enough to pin down a straight line
+        lo, hi = values.argmin(), values.argmax()
+        scale = (scaled[hi] - scaled[lo]) / (values[hi] - values[lo]) if values[hi] != values[lo] else 0.0
+        rows[col] = {'scale': scale, 'offset': scaled[lo] - values[lo] * scale}
+
+    return pd.DataFrame.from_dict(rows, orient='index')
+
+
+def _model_link(model):
+    # TweedieRegressor with link='auto' uses a log link for any power > 0, everything linear uses identity
+    link = getattr(model, 'link', 'identity')
+    if link == 'auto':
+        link = 'log' if model.power > 0 else 'identity'
+
+    return link
+
+
+def make_bundle(model, features, scaling=None, scaler_name=None, target='tax_value', id_col='parcel_id'):
+    '''
+    Packs a fitted linear model (LinearRegression, LassoLars, TweedieRegressor) into a dictionary that can be saved
+    as json and used for predictions without sklearn.
+    features: the columns the model was fit on, in order (ex: X_train.columns)
+    scaling: optional dataframe of scale and offset per raw column (from scaling_from_train or wrangle.scaler_params)
+    scaler_name: suffix of the scaled columns (ex: 'mm'). A feature named {col}_{scaler_name} is made from col
+    with the scaling, every other feature is used as is.
+    ex:
+        scaling = scaling_from_train(train, col_names, 'mm')
+        bundle = make_bundle(lm, X_train.columns, scaling, 'mm')
+        save_bundle(bundle, 'tax_value_model.json')
+    '''
+    scalers = {}
+    if scaling is not None:
+        for col, row in scaling.iterrows():
+            scalers[f'{col}_{scaler_name}'] = {'column': col, 'scale': float(row.scale), 'offset': float(row.offset)}
+
+    return {'target': target,
+            'id_col': id_col,
+            'features': list(features),
+            'scaling': {feature: scalers[feature] for feature in features if feature in scalers},
+            'coef': np.ravel(model.coef_).astype(float).tolist(),
+            'intercept': float(np.ravel(model.intercept_)[0]),
+            'link': _model_link(model)}
+
+
+def save_bundle(bundle, path):
+    '''
+    Writes a bundle from make_bundle to a json file.
+    '''
+    with open(path, 'w') as f:
+        json.dump(bundle, f, indent=2)
+
+
+def compile_bundle(bundle):
+    '''
+    Gets a bundle ready for predictions, once: the scaling is folded into the coefficients, so a prediction is
+    one matrix product on the raw columns (value * scale + offset times coef == value * (scale * coef) + offset * coef).
+    Features that come from the same raw column are added together.
+    Returns a dictionary with the raw columns, their weights, the intercept and the link.
+    '''
+    weights = {}
+    intercept = bundle['intercept']
+
+    for feature, coef in zip(bundle['features'], bundle['coef']):
+        scaling = bundle['scaling'].get(feature, {'column': feature, 'scale': 1.0, 'offset': 0.0})
+        weights[scaling['column']] = weights.get(scaling['column'], 0.0) + coef * scaling['scale']
+        intercept += coef * scaling['offset']
+
+    return {'columns': list(weights),
+            'weights': np.array(list(weights.values())),
+            'intercept': intercept,
+            'link': bundle['link'],
+            'target': bundle['target'],
+            'id_col': bundle['id_col']}
+
+
+def load_bundle(path):
+    '''
+    Reads a bundle saved with save_bundle and compiles it (see compile_bundle). Load it once, then predict as much as you want.
+    '''
+    with open(path) as f:
+        return compile_bundle(json.load(f))
+
+#################################### Predicting ####################################
+
+# raw columns prepare_records reads, and the columns it makes from them
+record_columns = ('has_pool', 'garage_car_count', 'fips')
+derived_columns = ('has_garage', 'county')
+
+
+def prepare_records(df):
+    '''
+    Cleans incoming records the same way wrangle_zillow does, for whichever of the columns are there:
+    pool_and_garage (has_pool and garage_car_count NaNs to 0, adds has_garage) and cali_counties (adds county).
+    Records come in with the column names of the zillow query (ex: garage_car_count, fips).
+    Returns a cleaned copy, df itself isn't changed.
+    '''
+    df = df.copy()
+
+    # same steps as pool_and_garage, with the fills assigned back (its inplace fillna does nothing
+    # under copy on write pandas)
+    if 'has_pool' in df:
+        df['has_pool'] = df.has_pool.fillna(value=0)
+
+    if 'garage_car_count' in df:
+        df['garage_car_count'] = df.garage_car_count.fillna(value=0)
+        df['has_garage'] = (df.garage_car_count != 0).astype(int)
+        df = df.drop(columns='garage_car_count')
+
+    if 'fips' in df and 'county' not in df:
+        df = w.cali_counties(df)
+
+    return df
+
+
+def predict_frame(model, df):
+    '''
+    Predicts the target for every row of df.
+    model: from load_bundle (or compile_bundle)
+    df: raw records, cleaned here with prepare_records
+    A record without has_pool or garage_car_count counts as 0, like a NaN in wrangle_zillow.
+    Returns an array of predictions (NaN where any other feature is missing).
+    '''
+    # every column the model and prepare_records read, whether or not any record in the batch has it,
+    # so a record scores the same whatever else is in its batch
+    needed = [col for col in model['columns'] if col not in derived_columns] + list(record_columns)
+    df = df.reindex(columns=list(df.columns) + [col for col in dict.fromkeys(needed) if col not in df])
+
+    df = prepare_records(df)
+    X = df[model['columns']].to_numpy(dtype=float)
+
+    yhat = X @ model['weights'] + model['intercept']
+
+    if model['link'] == 'log':
+        yhat = np.exp(yhat)
+
+    return yhat
+
+
+def _read_batches(source, batch_size):
+    # dataframes of at most batch_size rows from a csv or parquet file, a dataframe or an iterable of
+    # dataframes / record dictionaries
+    if isinstance(source, str) and source.endswith('.parquet'):
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(source).iter_batches(batch_size=batch_size):
+            yield batch.to_pandas()
+
+    elif isinstance(source, str):
+        yield from pd.read_csv(source, chunksize=batch_size)
+
+    elif isinstance(source, pd.DataFrame):
+        for start in range(0, len(source), batch_size):
+            yield source.iloc[start:start + batch_size].copy()
+
+    else:
+        records = []
+        for item in source:
+            if isinstance(item, pd.DataFrame):
+                yield item
+                continue
+            records.append(item)
+            if len(records) == batch_size:
+                yield pd.DataFrame.from_records(records)
+                records = []
+        if records:
+            yield pd.DataFrame.from_records(records)
+
+
+def predict_batches(model, source, batch_size=10_000):
+    '''
+    Scores records a batch at a time, so the input never has to fit in memory.
+    model: from load_bundle
+    source: path to a csv or parquet file, a dataframe, or an iterable of dataframes or record dictionaries
+    batch_size: rows per batch
+    Yields dataframes with the id column (if the records have it) and the prediction, named after the target.
+    ex: pd.concat(predict_batches(load_bundle('tax_value_model.json'), 'new_parcels.parquet'))
+    '''
+    for batch in _read_batches(source, batch_size):
+        out = pd.DataFrame({model['target']: predict_frame(model, batch)}, index=batch.index)
+        if model['id_col'] in batch:
+            out.insert(0, model['id_col'], batch[model['id_col']].to_numpy())
+        yield out
+
+#################################### Micro-batching ####################################
+
+def _json_value(value):
+    # json has no NaN
+    return None if np.isnan(value) else float(value)
+
+
+def _score_records(model, records):
+    '''
+    Scores a list of record dictionaries together, checking each record on its own first, so a bad record
+    only fails itself. Returns a list with the prediction (None where a feature is missing) or the exception
+    for every record, in order.
+    '''
+    # every column the model or prepare_records reads has to be a number (or missing)
+    columns = set(model['columns']) | set(record_columns)
+    results = [None] * len(records)
+    good = []
+
+    for i, record in enumerate(records):
+        try:
+            if not isinstance(record, dict):
+                raise TypeError(f'a record must be a json object, not {type(record).__name__}')
+            for col in columns.intersection(record):
+                if record[col] is not None:
+                    try:
+                        float(record[col])
+                    except (TypeError, ValueError):
+                        raise ValueError(f'{col} must be a number, not {record[col]!r}') from None
+            good.append(i)
+        except Exception as error:
+            results[i] = error
+
+    if good:
+        try:
+            yhat = predict_frame(model, pd.DataFrame.from_records([records[i] for i in good]))
+            for i, value in zip(good, yhat):
+                results[i] = _json_value(value)
+        except Exception as error:
+            for i in good:
+                results[i] = error
+
+    return results
+
+
+def serve_stdin(model, max_batch=1024, max_wait=.005, infile=None, outfile=None):
+    '''
+    Reads json records from stdin, one per line, and writes one json line per record with its prediction to stdout,
+    in the same order.
+    Lines are scored in micro-batches: whatever has come in (up to max_batch lines), waiting at most max_wait seconds
+    after the first line of a batch for more to show up. A lone record still gets scored right away.
+    A line that isn't valid json or can't be scored gets {"error": ...} and the stream keeps going.
+    '''
+    infile = infile or sys.stdin
+    outfile = outfile or sys.stdout
+    lines = queue.Queue()
+
+    # read on a thread, so the scoring loop can wait with a timeout
+    def read():
+        for line in infile:
+            if line.strip():
+                lines.put(line)
+        lines.put(None)
+
+    threading.Thread(target=read, daemon=True).start()
+
+    done = False
+    while not done:
+        batch = [lines.get()]
+        deadline = time.perf_counter() + max_wait
+        while batch[-1] is not None and len(batch) < max_batch:
+            try:
+                batch.append(lines.get(timeout=max(deadline - time.perf_counter(), 0)))
+            except queue.Empty:
+                break
+        if batch[-1] is None:
+            done = True
+            batch.pop()
+        if not batch:
+            continue
+
+        # parse each line on its own, so a bad line only gets an error back
+        records, results = [], [None] * len(batch)
+        for i, line in enumerate(batch):
+            try:
+                records.append((i, json.loads(line)))
+            except ValueError as error:
+                results[i] = error
+        for (i, _), result in zip(records, _score_records(model, [record for _, record in records])):
+            results[i] = result
+        parsed = dict(records)
+
+        for i, result in enumerate(results):
+            if isinstance(result, Exception):
+                out = {'error': str(result)}
+            else:
+                out = {model['target']: result}
+            record = parsed.get(i)
+            if isinstance(record, dict) and model['id_col'] in record:
+                out = {model['id_col']: record[model['id_col']], **out}
+            outfile.write(json.dumps(out) + '\n')
+        outfile.flush()
+
+
+class MicroBatcher:
+    '''
+    Collects records from many threads (ex: http requests) and scores them together.
+    submit blocks until its records are scored. The scoring thread takes whatever is waiting, up to max_batch
+    records, waiting at most max_wait seconds after the first request for more. A request with a bad record
+    gets the error, the other requests in the batch are still scored.
+    '''
+    def __init__(self, model, max_batch=1024, max_wait=.005):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, records):
+        '''
+        Scores a list of record dictionaries. Returns a list of predictions (None where a feature is missing).
+        '''
+        request = {'records': records, 'done': threading.Event()}
+        self.requests.put(request)
+        request['done'].wait()
+        if 'error' in request:
+            raise request['error']
+
+        return request['result']
+
+    def _run(self):
+        while True:
+            batch = [self.requests.get()]
+            size = len(batch[0]['records'])
+            deadline = time.perf_counter() + self.max_wait
+            while size < self.max_batch:
+                try:
+                    batch.append(self.requests.get(timeout=max(deadline - time.perf_counter(), 0)))
+                except queue.Empty:
+                    break
+                size += len(batch[-1]['records'])
+
+            try:
+                records = [record for request in batch for record in request['records']]
+                results = _score_records(self.model, records)
+                start = 0
+                for request in batch:
+                    result = results[start:start + len(request['records'])]
+                    start += len(request['records'])
+                    errors = [value for value in result if isinstance(value, Exception)]
+                    if errors:
+                        request['error'] = errors[0]
+                    else:
+                        request['result'] = result
+            except Exception as error:
+                for request in batch:
+                    request['error'] = error
+
+            for request in batch:
+                request['done'].set()
+
+
+def serve_http(model, host='127.0.0.1', port=8000, max_batch=1024, max_wait=.005):
+    '''
+    Runs a local http server for predictions. POST a json record, or a list of records, to any path.
+    The response is the prediction (or a list of them). Requests that come in at the same time are
+    scored together by a MicroBatcher.
+    '''
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    batcher = MicroBatcher(model, max_batch, max_wait)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                records = body if isinstance(body, list) else [body]
+                yhat = batcher.submit(records)
+                payload, status = (yhat if isinstance(body, list) else yhat[0]), 200
+            except Exception as error:
+                payload, status = {'error': str(error)}, 400
+
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            # no line per request on stderr
+            pass
+
+    with ThreadingHTTPServer((host, port), Handler) as server:
+        print(f'Serving predictions on http://{host}:{port}', file=sys.stderr)
+        server.serve_forever()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Score parcels with a saved model bundle.')
+    parser.add_argument('bundle', help='json file from save_bundle')
+    parser.add_argument('--input', help='csv or parquet file of records to score')
+    parser.add_argument('--output', help='where to write the predictions (csv). Default is stdout')
+    parser.add_argument('--batch-size', type=int, default=10_000)
+    parser.add_argument('--stdin', action='store_true', help='score json lines from stdin')
+    parser.add_argument('--serve', action='store_true', help='run the local http server')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--max-batch', type=int, default=1024)
+    parser.add_argument('--max-wait', type=float, default=.005)
+    args = parser.parse_args()
+
+    if not (args.input or args.stdin or args.serve):
+        parser.error('--input is required unless --stdin or --serve is given')
+
+    model = load_bundle(args.bundle)
+
+    if args.serve:
+        serve_http(model, port=args.port, max_batch=args.max_batch, max_wait=args.max_wait)
+    elif args.stdin:
+        serve_stdin(model, max_batch=args.max_batch, max_wait=args.max_wait)
+    else:
+        out = args.output or sys.stdout
+        for i, batch in enumerate(predict_batches(model, args.input, args.batch_size)):
+            batch.to_csv(out, index=False, header=(i == 0), mode='w' if i == 0 else 'a')
@@ -0,0 +1,106 @@
+# Synthetic data functions
+
+
+################ Imports ################
+import pandas as pd
+import numpy as np
+
+
+#################################### Zillow shaped data ####################################
+
+# counties and how common they are in the real data
+zillow_fips_shares = {6037: .64, 6059: .27, 6111: .09}
+
+# bathroom counts and how common they are (0 bathrooms is one of the things wrangle drops)
+zillow_bathroom_shares = {0: .004, 1: .17, 1.5: .015, 2: .42, 2.5: .07, 3: .2, 3.5: .02, 4: .05,
+                          4.5: .015, 5: .018, 6: .01, 7: .004, 8: .004}
+
+# rows are made this many at a time, each block from its own seed
+_block_size = 1_000_000
+
+
+def _zillow_block(n, rng, nan_rate, outlier_rate):
+    # one block of rows with the get_zillow_data columns (parcel_id gets filled in by make_zillow_data)
+    fips = rng.choice(list(zillow_fips_shares), n, p=list(zillow_fips_shares.values())).astype(float)
+
+    # size of the home drives bedrooms, bathrooms and value
+    sqft = np.exp(rng.normal(7.45, .4, n)).round()
+    bathrooms = rng.choice(list(zillow_bathroom_shares), n, p=np.array(list(zillow_bathroom_shares.values())) /
+                           sum(zillow_bathroom_shares.values()))
+    bedrooms = np.clip(np.round(sqft / 550 + rng.normal(0, .8, n)), 0, 8)
+
+    # pools are only ever 1 or NaN, garages are NaN for most of LA (the county doesn't report them)
+    has_pool = np.where(rng.random(n) < .21, 1.0, np.nan)
+    garage = rng.choice([0., 1., 2., 2., 2., 3., 4.], n)
+    garage[rng.random(n) < np.where(fips == 6037, .95, .1)] = np.nan
+
+    # value per square foot depends on the county, tax is about 1.2% of the value
+    price_per_sqft = np.exp(rng.normal(np.select([fips == 6037, fips == 6059], [5.6, 5.8], 5.5), .45))
+    tax_value = (sqft * price_per_sqft).round()
+    tax_amount = (tax_value * rng.normal(.0125, .0015, n) + rng.normal(0, 150, n)).round(2)
+
+    # transactions in the May-August "hot months" of 2017
+    days = rng.integers(0, 123, n).astype('timedelta64[D]')
+    transaction_date = (np.datetime64('2017-05-01') + days).astype('datetime64[ns]')
+
+    # outliers: mansions, and a few data entry mistakes
+    outliers = rng.random(n) < outlier_rate
+    sqft[outliers] *= rng.uniform(3, 12, outliers.sum())
+    bedrooms[outliers] += rng.integers(3, 12, outliers.sum())
+    bathrooms[outliers] += rng.integers(3, 10, outliers.sum())
+    tax_value[outliers] *= rng.uniform(3, 20, outliers.sum())
+
+    df = pd.DataFrame({'parcel_id': np.zeros(n, dtype='int64'),
+                       'tax_value': tax_value,
+                       'bathroom_cnt': bathrooms,
+                       'bedroom_cnt': bedrooms,
+                       'sqft_calculated': sqft,
+                       'has_pool': has_pool,
+                       'garage_car_count': garage,
+                       'fips': fips,
+                       'tax_amount': tax_amount,
+                       'transaction_date': transaction_date})
+
+    # scattered NaNs in the columns that have them in the real data
+    for col, rate in nan_rate.items():
+        df.loc[rng.random(n) < rate, col] = np.nan
+
+    return df
+
+
+def make_zillow_data(n_rows, seed=713, nan_rate=None, duplicate_rate=.002, outlier_rate=.005):
+    '''
+    Makes a fake dataframe shaped like get_zillow_data (same columns, dtypes and RangeIndex) with n_rows rows,
+    for testing and benchmarking without the database.
+    Distributions are made to look like the real thing: county shares, lognormal square feet and values,
+    bedrooms that go with square feet, pools only 1 or NaN, garages mostly missing in LA, tax about 1.2% of the value.
+    seed: same seed and n_rows always gives the same dataframe
+    nan_rate: dictionary of column --> share of NaNs. Default is roughly the real rates
+    duplicate_rate: share of rows that are exact copies of another row
+    outlier_rate: share of rows with very big sqft, bedrooms, bathrooms and value
+    ex: df = make_zillow_data(100_000); wrangle.clean_zillow(df)
+    '''
+    if nan_rate is None:
+        nan_rate = {'tax_value': .0004, 'sqft_calculated': .003, 'tax_amount': .0008, 'bedroom_cnt': .0002}
+
+    # one seed per block, so big frames can be made a block at a time
+    blocks = [min(_block_size, n_rows - start) for start in range(0, n_rows, _block_size)] or [0]
+    seeds = np.random.SeedSequence(seed).spawn(len(blocks) + 1)
+    df = pd.concat([_zillow_block(size, np.random.default_rng(s), nan_rate, outlier_rate)
+                    for size, s in zip(blocks, seeds)], ignore_index=True)
+
+    rng = np.random.default_rng(seeds[-1])
+
+    # unique parcel ids in the same range as the real ones, in no particular order
+    df['parcel_id'] = rng.permutation(10_000_000 + np.cumsum(rng.integers(1, 20, n_rows)))
+
+    # duplicates: copy earlier rows over some of the rows (the whole row, parcel_id too)
+    dupes = np.flatnonzero(rng.random(n_rows) < duplicate_rate)
+    dupes = dupes[dupes > 0]
+    source = (rng.random(len(dupes)) * dupes).astype('int64')
+    for col in df.columns:
+        values = df[col].to_numpy(copy=True)
+        values[dupes] = values[source]
+        df[col] = values
+
+    return df
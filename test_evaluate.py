@@ -0,0 +1,85 @@
+# Tests for the metrics and feature selection in evaluate.py, on synthetic zillow rows (synthetic.make_zillow_data)
+# run through fused_wrangle, so they run without the zillow database.
+# Run with: python -m pytest test_evaluate.py
+
+
+################ Imports ################
+import numpy as np
+import pytest
+
+import wrangle as w
+import synthetic as sy
+import evaluate as ev
+
+
+#################################### Fixtures ####################################
+
+features = ['sqft_calculated', 'bedroom_cnt', 'bathroom_cnt', 'has_pool', 'has_garage', 'tax_rate']
+
+
+@pytest.fixture(scope='module')
+def wrangled():
+    return w.fused_wrangle(sy.make_zillow_data(20_000)).reset_index(drop=True)
+
+
+@pytest.fixture(scope='module')
+def scored(wrangled):
+    # actuals and a least squares fit on the features, something for the metrics to score
+    X = np.column_stack([np.ones(len(wrangled)), wrangled[features].to_numpy(dtype=float)])
+    coef = np.linalg.lstsq(X, wrangled.tax_value.to_numpy(), rcond=None)[0]
+    return wrangled.tax_value, X @ coef
+
+
+#################################### Metrics ####################################
+
+def test_regression_metrics_matches_hip_to_be_square(scored):
+    y, yhat = scored
+    metrics = ev.regression_metrics(y, yhat)
+
+    for name, value in zip(('sse', 'mse', 'rmse', 'ess', 'tss'), ev.hip_to_be_square(y, yhat)):
+        assert metrics[name] == pytest.approx(value, rel=1e-9)
+    assert metrics['rmse_baseline'] == pytest.approx(ev.baseline_mean_errors(y)[2], rel=1e-9)
+
+
+def test_metric_accumulator_matches_hip_to_be_square(scored):
+    y, yhat = scored
+    y, yhat = y.to_numpy(), np.asarray(yhat)
+    expected = ev.hip_to_be_square(y, yhat)
+
+    # chunk by chunk, and two halves counted apart then merged
+    acc = ev.MetricAccumulator()
+    for start in range(0, len(y), 3_000):
+        acc.update(y[start:start + 3_000], yhat[start:start + 3_000])
+    half = len(y) // 2
+    merged = ev.MetricAccumulator().update(y[:half], yhat[:half]) + ev.MetricAccumulator().update(y[half:], yhat[half:])
+
+    for totals in (acc, merged, ev.score_chunks(zip(np.array_split(y, 7), np.array_split(yhat, 7)))):
+        assert totals.hip_to_be_square() == pytest.approx(expected, rel=1e-6)
+        assert totals.metrics()['mae'] == pytest.approx(np.abs(y - yhat).mean(), rel=1e-9)
+
+
+#################################### Feature selection ####################################
+
+@pytest.mark.parametrize('method, select', [('rfe', ev.rfe), ('kbest', ev.select_kbest)])
+def test_selected_features_matches_fit(wrangled, method, select):
+    X, y = wrangled[features], wrangled.tax_value
+    fingerprint = w.values_fingerprint(X, y)
+
+    for n in range(1, len(features) + 1):
+        assert ev.selected_features(X, y, n, method, fingerprint=fingerprint) == select(X, y, n)
+
+
+def test_gram_sweep_matches_linear_regression(wrangled):
+    from sklearn.linear_model import LinearRegression
+    from sklearn.metrics import mean_squared_error
+
+    train, validate = wrangled.iloc[:14_000], wrangled.iloc[14_000:]
+    sweep = ev.gram_sweep(train[features], train.tax_value, validate[features], validate.tax_value, max_features=3)
+
+    assert len(sweep) == 6 + 15 + 20
+    for row in sweep.itertuples():
+        lm = LinearRegression().fit(train[row.features], train.tax_value)
+        assert row.coef == pytest.approx(lm.coef_, rel=1e-6, abs=1e-6)
+        assert row.intercept == pytest.approx(lm.intercept_, rel=1e-6)
+        for X, y, rmse in ((train, train.tax_value, row.train_rmse), (validate, validate.tax_value, row.validate_rmse)):
+            assert rmse == pytest.approx(mean_squared_error(y, lm.predict(X[row.features])) ** .5, rel=1e-6)
@@ -0,0 +1,55 @@
+# Tests for the model bundles in predict.py, on synthetic zillow rows (synthetic.make_zillow_data),
+# so they run without the zillow database.
+# Run with: python -m pytest test_predict.py
+
+
+################ Imports ################
+import numpy as np
+import pytest
+
+import wrangle as w
+import synthetic as sy
+import predict as p
+
+
+#################################### Fixtures ####################################
+
+@pytest.fixture(scope='module')
+def raw():
+    return sy.make_zillow_data(20_000)
+
+
+@pytest.fixture(scope='module')
+def scaled(raw):
+    from sklearn.preprocessing import MinMaxScaler
+
+    train, validate, test = w.banana_split(w.fused_wrangle(raw))
+    col_names = ['sqft_calculated', 'bedroom_cnt', 'bathroom_cnt']
+    train, validate, test, _, scaled_cols = w.scale_columns(train, validate, test, col_names, MinMaxScaler(), 'mm')
+
+    return train, test, col_names, scaled_cols + ['has_pool', 'has_garage']
+
+
+#################################### Bundles ####################################
+
+@pytest.mark.filterwarnings('ignore::sklearn.exceptions.ConvergenceWarning')
+@pytest.mark.parametrize('model_name, params', [('LinearRegression', {}), ('TweedieRegressor', {'power': 1, 'alpha': 0})])
+def test_bundle_round_trip_matches_model(raw, scaled, tmp_path, model_name, params):
+    import sklearn.linear_model
+
+    train, test, col_names, features = scaled
+    model = getattr(sklearn.linear_model, model_name)(**params).fit(train[features], train.tax_value)
+
+    path = str(tmp_path / 'model.json')
+    p.save_bundle(p.make_bundle(model, features, p.scaling_from_train(train, col_names, 'mm'), 'mm'), path)
+    bundle = p.load_bundle(path)
+
+    # the raw records of the test rows, before any cleaning
+    records = raw.loc[test.index]
+    np.testing.assert_allclose(p.predict_frame(bundle, records), model.predict(test[features]), rtol=1e-9)
+
+    # a record scores the same on its own, without has_pool or garage_car_count in its batch
+    one = records[records.has_pool.isna() & records.garage_car_count.isna()].head(1)
+    assert len(one) == 1
+    np.testing.assert_allclose(p.predict_frame(bundle, one.drop(columns=['has_pool', 'garage_car_count'])),
+                               p.predict_frame(bundle, one), rtol=1e-12)
@@ -0,0 +1,161 @@
+# Tests for the database and wrangle paths, against a SQLite stand-in for the zillow database
+# (benchmark.make_sqlite_zillow), so they run without the Codeup server or env.py.
+# Run with: python -m pytest test_wrangle.py
+
+
+################ Imports ################
+import pandas as pd
+import pytest
+
+import wrangle as w
+import benchmark as b
+import synthetic as sy
+
+
+#################################### Fixtures ####################################
+
+@pytest.fixture(scope='module')
+def zillow_db(tmp_path_factory):
+    '''
+    Points the 'zillow' database at a small SQLite stand-in for the tests in this module.
+    '''
+    url = b.make_sqlite_zillow(str(tmp_path_factory.mktemp('db') / 'zillow.db'), n_rows=20_000)
+    w.register_database('zillow', url)
+    yield url
+    w.dispose_engines('zillow')
+    w.db_urls.pop('zillow', None)
+
+
+@pytest.fixture
+def expected(zillow_db, tmp_path):
+    # clean_zillow on the plain pull, what every other wrangle path has to give back
+    return w.clean_zillow(w.get_zillow_data(cache_dir=str(tmp_path)))
+
+
+@pytest.fixture
+def in_tmp_dir(zillow_db, tmp_path, monkeypatch):
+    # wrangle_zillow writes its caches to the working directory
+    monkeypatch.chdir(tmp_path)
+
+
+def _sorted(df):
+    # same rows in the same order, for paths that put the rows together in a different order
+    return df.sort_values(list(df.columns), kind='stable').reset_index(drop=True)
+
+
+#################################### Engines ####################################
+
+def test_get_engine_reuses_engine(zillow_db):
+    assert w.get_engine('zillow') is w.get_engine('zillow')
+
+
+def test_dispose_engines_makes_new_engine(zillow_db):
+    engine = w.get_engine('zillow')
+    w.dispose_engines('zillow')
+    assert w.get_engine('zillow') is not engine
+
+
+def test_register_database_replaces_engine(zillow_db):
+    engine = w.get_engine('zillow')
+    w.register_database('zillow', zillow_db)
+    assert w.get_engine('zillow') is not engine
+    assert str(w.get_engine('zillow').url) == zillow_db
+
+
+def test_get_many_data_matches_read_sql(zillow_db):
+    queries = w.zillow_queries_by('fips')
+    frames = w.get_many_data('zillow', queries, max_workers=3)
+
+    assert list(frames) == list(queries)
+    for code, sql_query in queries.items():
+        pd.testing.assert_frame_equal(frames[code], pd.read_sql(sql_query, w.get_engine('zillow')))
+
+
+def test_get_many_data_list_keeps_order(zillow_db):
+    queries = list(w.zillow_queries_by('month').values())
+    frames = w.get_many_data('zillow', queries)
+
+    assert len(frames) == len(queries)
+    for df, sql_query in zip(frames, queries):
+        pd.testing.assert_frame_equal(df, pd.read_sql(sql_query, w.get_engine('zillow')))
+
+
+#################################### Wrangle paths ####################################
+
+def test_fused_matches_clean_zillow(expected, in_tmp_dir):
+    pd.testing.assert_frame_equal(w.wrangle_zillow(fused=True), expected)
+
+
+def test_streamed_matches_clean_zillow(expected, in_tmp_dir):
+    pd.testing.assert_frame_equal(w.wrangle_zillow(chunksize=3_000), expected)
+
+
+@pytest.mark.parametrize('pushdown', [True, ('pool_and_garage', 'cali_counties')])
+def test_pushdown_matches_clean_zillow(expected, in_tmp_dir, pushdown):
+    # the pushed down frame is numbered 0 to n - 1 by the query
+    pd.testing.assert_frame_equal(w.wrangle_zillow(pushdown=pushdown).reset_index(drop=True),
+                                  expected.reset_index(drop=True))
+
+
+def test_partitioned_matches_clean_zillow(expected, in_tmp_dir):
+    # partitions are read month by month and county by county, so the rows come back in another order
+    pd.testing.assert_frame_equal(_sorted(w.wrangle_zillow(partitioned=True)), _sorted(expected))
+
+
+def test_partitioned_load_reads_cache_only(zillow_db, in_tmp_dir, tmp_path):
+    first = w.load_zillow_partitions()
+
+    # every partition is cached now, so loading again works without the database
+    w.register_database('zillow', f'sqlite:///{tmp_path / "missing" / "zillow.db"}')
+    try:
+        pd.testing.assert_frame_equal(w.load_zillow_partitions(), first)
+    finally:
+        w.register_database('zillow', zillow_db)
+
+
+def test_partitioned_empty_range_has_raw_columns(zillow_db, in_tmp_dir):
+    df = w.wrangle_zillow(partitioned=True, start_date='2017-09-01', end_date='2017-09-30')
+
+    assert len(df) == 0
+    assert list(df.columns) == list(w.wrangle_zillow(partitioned=True).columns)
+
+
+def test_remove_outlier_streaming_refuses_generators(expected):
+    chunks = [expected.iloc[start:start + 1_000] for start in range(0, len(expected), 1_000)]
+
+    with pytest.raises(TypeError):
+        list(w.remove_outlier_streaming(chunk for chunk in chunks))
+    assert sum(map(len, w.remove_outlier_streaming(lambda: iter(chunks)))) == sum(map(len, w.remove_outlier_streaming(chunks)))
+
+
+#################################### Splits ####################################
+
+@pytest.fixture(scope='module')
+def wrangled():
+    return w.fused_wrangle(sy.make_zillow_data(20_000))
+
+
+def test_split_indices_matches_banana_split(wrangled, tmp_path):
+    for split, expected in zip(w.banana_split_indexed(wrangled, cache_dir=str(tmp_path)), w.banana_split(wrangled)):
+        pd.testing.assert_frame_equal(split, expected)
+
+    # the second call reads the saved split
+    for split, expected in zip(w.banana_split_indexed(wrangled, cache_dir=str(tmp_path)), w.banana_split(wrangled)):
+        pd.testing.assert_frame_equal(split, expected)
+
+
+def test_split_indices_new_split_when_groups_change(wrangled, tmp_path):
+    before = w.split_indices(wrangled, stratify='county', cache_dir=str(tmp_path))
+
+    changed = wrangled.assign(county=wrangled.county.sample(frac=1, random_state=1).to_numpy())
+    after = w.split_indices(changed, stratify='county', cache_dir=str(tmp_path))
+    (tmp_path / 'fresh').mkdir()
+    fresh = w.split_indices(changed, stratify='county', cache_dir=str(tmp_path / 'fresh'))
+
+    assert (after['test'] == fresh['test']).all()
+    assert not (after['test'] == before['test']).all()
+
+
+def test_split_indices_hash_refuses_stratify(wrangled, tmp_path):
+    with pytest.raises(ValueError):
+        w.split_indices(wrangled, stratify='county', method='hash', cache_dir=str(tmp_path))
@@ -4,30 +4,175 @@
 ################ Imports ################
 import pandas as pd
 import numpy as np
-from env import host, password, user
 import os
-import scipy.stats as stats
+import json
+import hashlib
+import threading
 
-
-from sklearn.model_selection import train_test_split
+# scipy, sklearn and the database credentials are loaded the first time they're needed,
+# so importing wrangle (ex: just to read the cache) stays quick and works without env.py
 
 ###################### Getting database Url ################
-def get_db_url(db_name, user=user, host=host, password=password):
+
+# environment variable --> name in env.py
+credential_variables = {'DB_USER': 'user', 'DB_PASSWORD': 'password', 'DB_HOST': 'host'}
+
+
+def get_credentials():
+    '''
+    Returns a dictionary with the user, password and host for the database.
+    Each one comes from its environment variable (DB_USER, DB_PASSWORD, DB_HOST) when it's set,
+    otherwise from the env file.
+    '''
+    credentials = {name: os.environ.get(variable) for variable, name in credential_variables.items()}
+
+    missing = [name for name, value in credentials.items() if value is None]
+    if missing:
+        try:
+            import env
+        except ImportError:
+            raise ImportError(f'No database {", ".join(missing)}: set {", ".join(credential_variables)} '
+                              'or add an env.py with user, password and host') from None
+        for name in missing:
+            credentials[name] = getattr(env, name)
+
+    return credentials
+
+
+def __getattr__(name):
+    # wrangle.user, wrangle.host and wrangle.password still work, loaded on first use
+    if name in credential_variables.values():
+        return get_credentials()[name]
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def get_db_url(db_name, user=None, host=None, password=None):
     """
-        This helper function takes as default the user host and password from the env file.
+        This helper function takes as default the user host and password from the environment variables or the env file.
         You must input the database name. It returns the appropriate URL to use in connecting to a database.
     """
+    if None in (user, host, password):
+        credentials = get_credentials()
+        user = credentials['user'] if user is None else user
+        host = credentials['host'] if host is None else host
+        password = credentials['password'] if password is None else password
+
     url = f'mysql+pymysql://{user}:{password}@{host}/{db_name}'
     return url
 
 
+###################### Pooled database engines ################
+
+# db_name --> engine. Made the first time get_engine is asked for that database, then re-used
+_engines = {}
+_engines_lock = threading.Lock()
+
+# db_name --> url to use instead of get_db_url(db_name), ex: a local sqlite stand-in for testing
+db_urls = {}
+
+# default pool settings for new engines. pool_pre_ping checks a connection before handing it out,
+# pool_recycle (seconds) replaces connections before the MySQL server times them out
+engine_options = {
+    'pool_size': 5,
+    'max_overflow': 10,
+    'pool_pre_ping': True,
+    'pool_recycle': 3600,
+}
+
+
+def register_database(db_name, url):
+    '''
+    Points db_name at url instead of the Codeup MySQL server.
+    ex: register_database('zillow', 'sqlite:///zillow.db')
+    '''
+    db_urls[db_name] = url
+    dispose_engines(db_name)
+
+
+def get_engine(db_name, **options):
+    '''
+    Returns the pooled SQLAlchemy engine for db_name, making it the first time it is asked for.
+    Every call after that re-uses the same engine (and its open connections).
+    options: override engine_options (pool_size, max_overflow, pool_pre_ping, pool_recycle).
+    Options only apply when the engine is made, call dispose_engines first to change them.
+    '''
+    engine = _engines.get(db_name)
+    if engine is not None:
+        return engine
+
+    from sqlalchemy import create_engine
+
+    with _engines_lock:
+        # another thread may have made it while we waited on the lock
+        if db_name not in _engines:
+            url = db_urls.get(db_name) or get_db_url(db_name)
+            kwargs = {**engine_options, **options}
+            if url.startswith('sqlite'):
+                # sqlite does not use a sized connection pool
+                kwargs.pop('pool_size', None)
+                kwargs.pop('max_overflow', None)
+            _engines[db_name] = create_engine(url, **kwargs)
+
+    return _engines[db_name]
+
+
+def dispose_engines(db_name=None):
+    '''
+    Closes the pooled connections for db_name (or every database when db_name is None)
+    and forgets the engine, the next get_engine call makes a new one.
+    '''
+    with _engines_lock:
+        names = list(_engines) if db_name is None else [db_name]
+        for name in names:
+            engine = _engines.pop(name, None)
+            if engine is not None:
+                engine.dispose()
+
+
 ######################### get generic data #########################
-def get_any_data(database, sql_query):
+def get_any_data(database, sql_query, chunksize=None):
     '''
     put in the query and the database and get the data you need in a dataframe
+    optional arg chunksize: number of rows per chunk. When set, returns a generator of dataframes instead,
+    read from the database with a server side cursor so the whole result is never in memory at once
+    '''
+    if chunksize is not None:
+        return _stream_sql(database, sql_query, chunksize)
+
+    return pd.read_sql(sql_query, get_engine(database))
+
+
+def _stream_sql(database, sql_query, chunksize):
     '''
+    Generator behind get_any_data(chunksize=...). stream_results makes pymysql use an unbuffered
+    (server side) cursor, so rows are pulled from the server as the chunks are consumed.
+    '''
+    with get_engine(database).connect() as conn:
+        conn = conn.execution_options(stream_results=True)
+        for chunk in pd.read_sql(sql_query, conn, chunksize=chunksize):
+            yield chunk
+
+
+def get_many_data(database, queries, max_workers=None):
+    '''
+    Runs several queries against database at the same time, on threads sharing the pooled engine.
+    queries: list of sql queries, or a dictionary of name --> sql query
+    max_workers: number of queries running at once. Default is the pool_size in engine_options
+    Returns a list of dataframes in the same order as queries (or a dictionary with the same keys).
+    ex: frames = get_many_data('zillow', zillow_queries_by('fips'))
+    '''
+    from concurrent.futures import ThreadPoolExecutor
+
+    names = list(queries) if isinstance(queries, dict) else None
+    sql_list = [queries[name] for name in names] if names is not None else list(queries)
+
+    # make the engine before the threads start so they all share it
+    engine = get_engine(database)
 
-    return pd.read_sql(sql_query, get_db_url(database))
+    with ThreadPoolExecutor(max_workers=max_workers or engine_options['pool_size']) as pool:
+        frames = list(pool.map(lambda sql_query: pd.read_sql(sql_query, engine), sql_list))
+
+    return dict(zip(names, frames)) if names is not None else frames
 
 ################ train test split helper function ################
 def banana_split(df):
@@ -37,6 +182,8 @@ def banana_split(df):
     performs a split.
     Returns train, validate, and test dfs.
     '''
+    from sklearn.model_selection import train_test_split
+
     train_validate, test = train_test_split(df, test_size=.2, 
                                         random_state=713)
     train, validate = train_test_split(train_validate, test_size=.3, 
@@ -48,6 +195,133 @@ def banana_split(df):
 
 
 
+################ fingerprints ################
+# short hashes used to key cached results. Both use blake2b, they differ in how much of the data they read
+
+def rows_fingerprint(df, id_col='parcel_id'):
+    '''
+    Returns a short hash that identifies the rows of df: its shape, column names, index and id column (if it has one).
+    Doesn't read the other values, so it's cheap, and enough to notice rows being added, removed or reordered
+    (ex: split_indices). Use values_fingerprint when any changed value has to give a new hash.
+    '''
+    digest = hashlib.blake2b(f'{df.shape}|{"|".join(map(str, df.columns))}'.encode(), digest_size=8)
+    digest.update(pd.util.hash_pandas_object(df.index).to_numpy().tobytes())
+    
+    if id_col in df.columns:
+        digest.update(pd.util.hash_array(df[id_col].to_numpy()).tobytes())
+        
+    return digest.hexdigest()
+
+
+def values_fingerprint(*data):
+    '''
+    Returns a short hash of every value of each dataframe, series or array in data (for dataframes also the index
+    and column names), so changing any value gives a new hash. Goes through all the data, so with big data
+    work it out once and pass it along.
+    ex: values_fingerprint(X_train, y_train) (evaluate's feature selection cache), values_fingerprint(array)
+    '''
+    digest = hashlib.blake2b(digest_size=8)
+    
+    for item in data:
+        if isinstance(item, pd.DataFrame):
+            digest.update('|'.join(map(str, item.columns)).encode())
+            digest.update(pd.util.hash_pandas_object(item, index=True).to_numpy().tobytes())
+        else:
+            values = np.asarray(item)
+            digest.update(f'{values.dtype}{values.shape}'.encode())
+            # objects (ex: strings) have no fixed bytes, pandas hashes them by value
+            digest.update(pd.util.hash_array(values.ravel()).tobytes() if values.dtype == object
+                          else np.ascontiguousarray(values).tobytes())
+            
+    return digest.hexdigest()
+
+
+################ cached split indices ################
+
+
+def split_indices(df, test_size=.2, validate_size=.3, seed=713, stratify=None, method='random',
+                  id_col='parcel_id', cache_dir='.'):
+    '''
+    Works out which rows (positions, like iloc) go in train, validate and test, without copying any data,
+    and saves them so the next call with the same data and settings just reads them back.
+    test_size: share of all rows in test. validate_size: share of the rest in validate (same as banana_split)
+    stratify: optional column name (ex: 'county' or 'fips') to keep the same mix of it in every split
+    method: 'random' gives exactly the rows banana_split gives (same seed, same train_test_split shuffles).
+            'hash' puts each row in a split based on a hash of its id_col (and the seed), so a parcel stays in the
+            same split when new data comes in (ex: from refresh_zillow_partitions). Each stratify group ends up
+            split in roughly the right shares on its own, so it doesn't take stratify (ValueError).
+    The cache file name has the seed, sizes, method, stratify column and rows_fingerprint in it,
+    and the values_fingerprint of the stratify column (so changed groups give a new split).
+    Returns a dictionary of 'train', 'validate', 'test' --> arrays of row positions.
+    '''
+    if method == 'hash' and stratify is not None:
+        raise ValueError("method='hash' splits each row on its own id, it can't stratify. Use method='random'")
+
+    groups_key = values_fingerprint(df[stratify]) if stratify is not None else None
+    key = hashlib.sha256(f'{rows_fingerprint(df, id_col)}|{test_size}|{validate_size}|{seed}|{stratify}|{groups_key}'
+                         f'|{method}|{id_col}'.encode()).hexdigest()[:16]
+    path = os.path.join(cache_dir, f'split_{key}.npz')
+    
+    if os.path.isfile(path):
+        with np.load(path) as cached:
+            return {name: cached[name] for name in ('train', 'validate', 'test')}
+    
+    if method == 'random':
+        from sklearn.model_selection import train_test_split
+
+        positions = np.arange(len(df))
+        groups = df[stratify].to_numpy() if stratify is not None else None
+        
+        train_validate, test = train_test_split(positions, test_size=test_size, random_state=seed, stratify=groups)
+        train, validate = train_test_split(train_validate, test_size=validate_size, random_state=seed,
+                                           stratify=groups[train_validate] if groups is not None else None)
+        
+    elif method == 'hash':
+        ids = df[id_col].to_numpy().astype('uint64')
+        
+        # mix the seed in before hashing, then turn the top 53 bits of the hash into a number in [0, 1)
+        hashed = pd.util.hash_array(ids ^ np.uint64(seed))
+        u = (hashed >> np.uint64(11)).astype(float) / 2 ** 53
+        
+        test = np.flatnonzero(u < test_size)
+        validate = np.flatnonzero((u >= test_size) & (u < test_size + (1 - test_size) * validate_size))
+        train = np.flatnonzero(u >= test_size + (1 - test_size) * validate_size)
+        
+    else:
+        raise ValueError(f"method must be 'random' or 'hash', not {method!r}")
+    
+    indices = {'train': train, 'validate': validate, 'test': test}
+    
+    np.savez(f'{path}.tmp.npz', **indices)
+    os.replace(f'{path}.tmp.npz', path)
+    
+    return indices
+
+
+def banana_split_indexed(df, test_size=.2, validate_size=.3, seed=713, stratify=None, method='random',
+                         lazy=False, cache_dir='.'):
+    '''
+    banana_split using split_indices: with method='random' it gives the same train, validate and test,
+    but each split is taken from df in one go (no in between train_validate copy), and the shuffles
+    are only worked out the first time. See split_indices for the arguments.
+    lazy: bool. return three functions that make train, validate and test when called, instead of the dataframes
+    (pandas can't make views of scattered rows, so this puts off the copy until a split is actually used)
+    Returns train, validate, and test dfs (or functions with lazy=True).
+    '''
+    indices = split_indices(df, test_size, validate_size, seed, stratify, method, cache_dir=cache_dir)
+    
+    if lazy:
+        return tuple((lambda idx=indices[name]: df.take(idx)) for name in ('train', 'validate', 'test'))
+    
+    train, validate, test = [df.take(indices[name]) for name in ('train', 'validate', 'test')]
+    
+    print(f'train --> {train.shape}')
+    print(f'validate --> {validate.shape}')
+    print(f'test --> {test.shape}')
+    return train, validate, test
+
+
+
 ################ Scaler helper function ################
 def my_scaler(train, validate, test, col_names, scaler, scaler_name):
     
@@ -91,14 +365,418 @@ def my_scaler(train, validate, test, col_names, scaler, scaler_name):
     #returns scaler, and a list of column names that can be used in X_train, X_validate and X_test.
     return scaler, scaled_cols_list   
 
+
+def scale_columns(train, validate, test, col_names, scaler, scaler_name, as_array=False):
+    '''
+    Same idea as my_scaler, but fits the scaler on all of col_names at once (one fit on train, one transform each
+    for validate and test) so the scaler remembers every column and can inverse transform all of them.
+    The scaled columns are added as one block, instead of one new column at a time.
+    Returns new train, validate and test dataframes (the inputs are not changed), the fitted scaler
+    and the list of new column names.
+    as_array: bool. return float32 arrays of just the scaled columns (ready for a model) instead of dataframes
+    ex: train, validate, test, mm_scaler, scaled_cols = scale_columns(train, validate, test, ['sqft_calculated', 'bedroom_cnt'], MinMaxScaler(), 'mm')
+    '''
+    scaled_cols = [f'{col}_{scaler_name}' for col in col_names]
+    
+    # fit once on every column of train
+    scaler.fit(train[col_names])
+    
+    scaled = [scaler.transform(df[col_names]) for df in (train, validate, test)]
+    
+    if as_array:
+        train, validate, test = [np.asarray(values, dtype=np.float32) for values in scaled]
+    else:
+        train, validate, test = [pd.concat([df, pd.DataFrame(values, index=df.index, columns=scaled_cols)], axis=1)
+                                 for df, values in zip((train, validate, test), scaled)]
+    
+    return train, validate, test, scaler, scaled_cols
+
+
+def scaler_params(scaler, col_names):
+    '''
+    Takes in a fitted scaler (fitted on col_names, ex: from scale_columns) and returns a dataframe with one row per column:
+    scale and offset, so that scaled = value * scale + offset. Works for any scaler that scales each column
+    on its own in a straight line (MinMaxScaler, StandardScaler, RobustScaler, MaxAbsScaler).
+    Use it to inverse transform any one column: value = (scaled - offset) / scale
+    '''
+    zeros = pd.DataFrame(np.zeros((1, len(col_names))), columns=col_names)
+    
+    offset = scaler.transform(zeros)[0]
+    scale = scaler.transform(zeros + 1)[0] - offset
+    
+    return pd.DataFrame({'scale': scale, 'offset': offset}, index=col_names)
+
+
+def inverse_scale(scaler, values, col_names, column):
+    '''
+    Undoes the scaling of one column.
+    scaler: fitted on col_names (ex: from scale_columns)
+    values: scaled values of column
+    column: which of col_names the values came from
+    '''
+    params = scaler_params(scaler, col_names).loc[column]
+    
+    return (np.asarray(values) - params.offset) / params.scale
+
+
+def fit_scaler_chunks(chunks, col_names, scaler):
+    '''
+    Fits a scaler that supports partial_fit (MinMaxScaler, StandardScaler, MaxAbsScaler) one chunk at a time,
+    so it can be fit on data that doesn't fit in memory.
+    chunks: iterable of dataframes
+    Returns the fitted scaler.
+    '''
+    for chunk in chunks:
+        scaler.partial_fit(chunk[col_names])
+        
+    return scaler
+
+
+def scale_chunks(chunks, scaler, col_names, scaler_name):
+    '''
+    Adds the scaled columns (named {col}_{scaler_name}) to each chunk with a scaler that's already fit
+    (ex: fit_scaler_chunks on train). Yields the chunks.
+    '''
+    scaled_cols = [f'{col}_{scaler_name}' for col in col_names]
+    
+    for chunk in chunks:
+        yield pd.concat([chunk, pd.DataFrame(scaler.transform(chunk[col_names]), index=chunk.index, columns=scaled_cols)],
+                        axis=1)
+
+    
+#################################### cache backends ####################################
+
+def query_fingerprint(sql_query, db_name):
+    '''
+    Takes in a sql query and the database name it runs against and returns a short hash of the two.
+    Whitespace in the query is normalized first, so re-indenting the query keeps the same fingerprint,
+    but any real edit to the query (or a different database) gives a new one.
+    '''
+    normalized = ' '.join(sql_query.split())
+    
+    return hashlib.sha256(f'{db_name}\n{normalized}'.encode()).hexdigest()[:16]
+
+
+def _read_csv_cache(path, memory_map=False):
+    return pd.read_csv(path, index_col=0, memory_map=memory_map)
+
+def _write_csv_cache(df, path):
+    df.to_csv(path)
+
+def _read_parquet_cache(path, memory_map=True):
+    return pd.read_parquet(path, memory_map=memory_map)
+
+def _write_parquet_cache(df, path):
+    df.to_parquet(path)
+
+def _read_feather_cache(path, memory_map=True):
+    import pyarrow.feather as feather
+    # read through pyarrow so the file can be memory mapped and the index is restored
+    return feather.read_table(path, memory_map=memory_map).to_pandas()
+
+def _write_feather_cache(df, path):
+    import pyarrow.feather as feather
+    feather.write_feather(df, path)
+
+
+# format name --> (reader, writer). readers take (path, memory_map), writers take (df, path)
+cache_backends = {
+    'csv': (_read_csv_cache, _write_csv_cache),
+    'parquet': (_read_parquet_cache, _write_parquet_cache),
+    'feather': (_read_feather_cache, _write_feather_cache),
+}
+
+
+def register_cache_backend(cache_format, reader, writer):
+    '''
+    Adds (or replaces) a cache backend.
+    cache_format: string name of the format, also used as the file extension
+    reader: function that takes (path, memory_map) and returns a dataframe
+    writer: function that takes (df, path) and writes the dataframe to path
+    '''
+    cache_backends[cache_format] = (reader, writer)
+
+
+def _get_cache_backend(cache_format):
+    if cache_format not in cache_backends:
+        raise ValueError(f'Unknown cache format {cache_format!r}. Options are: {sorted(cache_backends)}')
+    return cache_backends[cache_format]
+
+
+def cache_path(sql_query, db_name, cache_format='parquet', prefix='zillow_data', cache_dir='.'):
+    '''
+    Returns the path of the cache file for a query. The file name has the query fingerprint in it,
+    so editing the query points at a new file instead of re-using a stale one.
+    ex: zillow_data_1f2e3d4c5b6a7980.parquet
+    '''
+    return os.path.join(cache_dir, f'{prefix}_{query_fingerprint(sql_query, db_name)}.{cache_format}')
+
+
+def read_cache(path, cache_format='parquet', memory_map=True):
+    '''
+    Reads a cache file written by write_cache with the backend for cache_format.
+    memory_map: bool. memory map the file instead of reading it into a buffer first (ignored by csv)
+    '''
+    reader, _ = _get_cache_backend(cache_format)
+    
+    return reader(path, memory_map=memory_map)
+
+
+def write_cache(df, path, cache_format='parquet'):
+    '''
+    Writes df to path with the backend for cache_format.
+    The file is written under a temporary name first and then moved into place,
+    so an interrupted write never leaves a half written cache behind.
+    '''
+    _, writer = _get_cache_backend(cache_format)
+    
+    tmp_path = f'{path}.tmp'
+    writer(df, tmp_path)
+    os.replace(tmp_path, path)
+
+
+class _CsvAppender:
+    '''
+    Appends chunks to one csv file, header only on the first chunk.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.rows = 0
+
+    def write(self, df):
+        df.to_csv(self.path, mode='a' if self.rows else 'w', header=not self.rows)
+        self.rows += len(df)
+
+    def close(self):
+        pass
+
+
+class _ArrowAppender:
+    '''
+    Appends chunks to one parquet file (one row group per chunk) or feather file (one record batch per chunk).
+    The schema of the first chunk is used for every chunk after it.
+    '''
+    def __init__(self, path, cache_format):
+        self.path = path
+        self.cache_format = cache_format
+        self.writer = None
+        self.rows = 0
+
+    def write(self, df):
+        import pyarrow as pa
+
+        if self.writer is None:
+            table = pa.Table.from_pandas(df, preserve_index=True)
+            if self.cache_format == 'parquet':
+                import pyarrow.parquet as pq
+                self.writer = pq.ParquetWriter(self.path, table.schema)
+            else:
+                self.writer = pa.ipc.new_file(self.path, table.schema)
+            self.schema = table.schema
+        else:
+            table = pa.Table.from_pandas(df, schema=self.schema, preserve_index=True)
+
+        self.writer.write_table(table)
+        self.rows += len(df)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+# format name --> function that takes a path and returns an appender (has .write(df), .close() and .rows)
+cache_appenders = {
+    'csv': _CsvAppender,
+    'parquet': lambda path: _ArrowAppender(path, 'parquet'),
+    'feather': lambda path: _ArrowAppender(path, 'feather'),
+}
+
+
+def write_cache_chunks(chunks, path, cache_format='parquet', empty=None):
+    '''
+    Writes an iterable of dataframe chunks to one cache file as they come in, so only one chunk
+    is in memory at a time. Empty chunks are skipped (they have no dtypes to build a schema from).
+    empty: optional empty dataframe with the right columns, written if every chunk was empty
+    Like write_cache, the file is only moved into place once every chunk has been written.
+    Returns the number of rows written.
+    '''
+    if cache_format not in cache_appenders:
+        raise ValueError(f'Cache format {cache_format!r} does not support appending. Options are: {sorted(cache_appenders)}')
+    
+    tmp_path = f'{path}.tmp'
+    appender = cache_appenders[cache_format](tmp_path)
+    try:
+        for chunk in chunks:
+            if len(chunk):
+                appender.write(chunk)
+    finally:
+        appender.close()
+
+    if appender.rows == 0:
+        if empty is None:
+            raise ValueError('No rows to cache.')
+        write_cache(empty, tmp_path, cache_format=cache_format)
+
+    os.replace(tmp_path, path)
+
+    return appender.rows
+
+
+def iter_cache(path, cache_format='parquet', chunksize=50_000):
+    '''
+    Reads a cache file back chunksize rows at a time. Returns a generator of dataframes.
+    '''
+    if cache_format == 'csv':
+        yield from pd.read_csv(path, index_col=0, chunksize=chunksize)
+        
+    elif cache_format == 'parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        
+        parquet_file = pq.ParquetFile(path, memory_map=True)
+        for batch in parquet_file.iter_batches(batch_size=chunksize):
+            # going through a table puts the index back from the pandas metadata
+            yield pa.Table.from_batches([batch], schema=parquet_file.schema_arrow).to_pandas()
+            
+    elif cache_format == 'feather':
+        import pyarrow as pa
+        
+        with pa.memory_map(path) as source:
+            reader = pa.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                table = pa.Table.from_batches([reader.get_batch(i)], schema=reader.schema)
+                # feather chunks are whatever size they were written with, re-slice to chunksize
+                for start in range(0, table.num_rows, chunksize):
+                    yield table.slice(start, chunksize).to_pandas()
+    else:
+        # no chunked reader for this format, read it all and slice
+        df = read_cache(path, cache_format=cache_format)
+        for start in range(0, len(df), chunksize):
+            yield df.iloc[start:start + chunksize]
+
     
 #################################### get ZILLOW data ####################################
-def get_zillow_data():
+
+# columns of get_zillow_data and the dtypes read_sql gives them (transaction_date is parsed after)
+zillow_raw_dtypes = {
+    'parcel_id': 'int64',
+    'tax_value': 'float64',
+    'bathroom_cnt': 'float64',
+    'bedroom_cnt': 'float64',
+    'sqft_calculated': 'float64',
+    'has_pool': 'float64',
+    'garage_car_count': 'float64',
+    'fips': 'float64',
+    'tax_amount': 'float64',
+    'transaction_date': 'object',
+}
+
+
+def _empty_zillow_data():
+    # no rows, but the columns and dtypes of get_zillow_data, so the wrangle steps still run on it
+    df = pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in zillow_raw_dtypes.items()})
+    df['transaction_date'] = pd.to_datetime(df.transaction_date)
+    return df
+
+
+# wrangle steps that can run in the query instead of in pandas, in the order clean_zillow runs them
+pushdown_steps = ('pool_and_garage', 'cali_counties', 'tax_rate', 'drop_the_cols')
+
+
+def _pushdown_steps(pushdown):
+    # True --> every step, False/None --> none. Otherwise the steps have to be the first steps of pushdown_steps,
+    # the steps after them run in pandas and need the earlier ones done
+    if pushdown is True:
+        return pushdown_steps
+    if not pushdown:
+        return ()
+
+    steps = tuple(pushdown)
+    if steps != pushdown_steps[:len(steps)]:
+        raise ValueError(f'pushdown has to be the first steps of {pushdown_steps}, in order. Got {steps}')
+    return steps
+
+
+def _pushdown_select(steps):
+    # column name --> sql expression, with the pushed down steps done in sql
+    columns = {'parcel_id': 'p.parcelid',
+               'tax_value': 'taxvaluedollarcnt',
+               'bathroom_cnt': 'bathroomcnt',
+               'bedroom_cnt': 'bedroomcnt',
+               'sqft_calculated': 'calculatedfinishedsquarefeet',
+               'has_pool': 'poolcnt',
+               'garage_car_count': 'garagecarcnt',
+               'fips': 'p.fips',
+               'tax_amount': 'taxamount',
+               'transaction_date': 'transactiondate'}
+    conditions = []
+
+    if 'pool_and_garage' in steps:
+        columns['has_pool'] = 'COALESCE(poolcnt, 0)'
+        del columns['garage_car_count']
+        columns['has_garage'] = 'CASE WHEN COALESCE(garagecarcnt, 0) <> 0 THEN 1 ELSE 0 END'
+
+    if 'cali_counties' in steps:
+        # fips codes that aren't in the list come back NULL (pandas .replace leaves the number)
+        columns['county'] = "CASE p.fips WHEN 6037 THEN 'LA' WHEN 6059 THEN 'Orange' WHEN 6111 THEN 'Ventura' END"
+
+    if 'tax_rate' in steps:
+        # x / 0 is NULL in sql, get_zillow_data puts back the inf pandas gives
+        columns['tax_rate'] = 'taxamount / taxvaluedollarcnt'
+
+    if 'drop_the_cols' in steps:
+        # no NULLs (has_pool and has_garage are already filled), no 0 bathrooms, and no 0 / 0 tax rates
+        conditions += [f'{columns[col]} IS NOT NULL' for col in columns
+                       if col not in ('has_pool', 'has_garage', 'county', 'tax_rate')]
+        conditions += ['bathroomcnt <> 0', 'NOT (taxvaluedollarcnt = 0 AND taxamount = 0)']
+
+    return columns, conditions
+
+
+def build_zillow_query(land_use_types=(261,), start_date='2017-05-01', end_date='2017-08-31', fips=None,
+                       pushdown=False):
     '''
-    This function reads in Zillow data from Codeup database, writes data to
-    a csv file if a local file does not exist, and returns a df.
+    Builds the sql query for the Zillow data.
+    land_use_types: propertylandusetypeid values to keep. Default is (261,), single family. None keeps every land use type
+    start_date, end_date: transaction dates to keep (inclusive). Default is the May-August "hot months".
+    None for either one leaves that end of the range open.
+    fips: fips codes (counties) to keep. Default None keeps every county
+    pushdown: do wrangle steps in the query instead of in pandas, so fewer rows and columns come back.
+    True does every step in pushdown_steps (pool_and_garage, cali_counties, tax_rate, drop_the_cols),
+    or pass the first few of them (ex: ('pool_and_garage', 'cali_counties'))
+    ex: all of 2017, every land use type --> build_zillow_query(None, '2017-01-01', '2017-12-31')
     '''
-    sql_query = '''
+    conditions = []
+
+    if land_use_types is not None:
+        conditions.append(f"p.`propertylandusetypeid` IN ({', '.join(str(int(t)) for t in land_use_types)})")
+
+    if fips is not None:
+        conditions.append(f"p.`fips` IN ({', '.join(str(int(code)) for code in fips)})")
+
+    # run the dates through pandas so only real dates end up in the query
+    if start_date is not None:
+        conditions.append(f"pred.`transactiondate` >= '{pd.Timestamp(start_date):%Y-%m-%d}'")
+    if end_date is not None:
+        conditions.append(f"pred.`transactiondate` <= '{pd.Timestamp(end_date):%Y-%m-%d}'")
+
+    steps = _pushdown_steps(pushdown)
+    if steps:
+        columns, step_conditions = _pushdown_select(steps)
+        select = ',\n                '.join(f'{expression} AS {name}' for name, expression in columns.items())
+        conditions += step_conditions
+        where = ('WHERE ' + '\n                \tAND '.join(conditions)) if conditions else ''
+
+        return f'''
+                SELECT {select}
+                FROM properties_2017 AS p
+                JOIN predictions_2017 AS pred ON p.`parcelid` = pred.`parcelid`
+                {where};
+                '''
+
+    where = ('WHERE ' + '\n                \tAND '.join(conditions)) if conditions else ''
+
+    return f'''
                 SELECT p.parcelid AS parcel_id,
                 taxvaluedollarcnt AS tax_value,
                 bathroomcnt AS bathroom_cnt,
@@ -111,24 +789,219 @@ def get_zillow_data():
                 transactiondate AS transaction_date
                 FROM properties_2017 AS p
                 JOIN predictions_2017 AS pred ON p.`parcelid` = pred.`parcelid`
-                WHERE p.`propertylandusetypeid` IN (261) 
-                	AND pred.`transactiondate` BETWEEN '2017-05-01' AND '2017-08-31';
+                {where};
                 '''
-    if os.path.isfile('zillow_data.csv'):
+
+# the query for the project data set (single family, May-August 2017)
+zillow_sql_query = build_zillow_query()
+
+# fips codes of the three counties in the data (see cali_counties)
+zillow_fips = (6037, 6059, 6111)
+
+
+def zillow_queries_by(by='fips', land_use_types=(261,), start_date='2017-05-01', end_date='2017-08-31', fips=None):
+    '''
+    Splits the Zillow query into one query per county (by='fips') or per transaction month (by='month'),
+    ready for get_many_data to run at the same time.
+    fips: counties to keep. Default None is every county (for by='fips', the three in zillow_fips)
+    Returns a dictionary of fips code or 'YYYY-MM' --> sql query.
+    ex: df = pd.concat(get_many_data('zillow', zillow_queries_by('month')).values())
+    '''
+    if by == 'fips':
+        return {code: build_zillow_query(land_use_types, start_date, end_date, fips=[code]) for code in (fips or zillow_fips)}
+
+    if by == 'month':
+        queries = {}
+        for month in pd.period_range(start_date, end_date, freq='M'):
+            # clip the first and last month to the requested range
+            month_start = max(month.start_time, pd.Timestamp(start_date))
+            month_end = min(month.end_time.normalize(), pd.Timestamp(end_date))
+            queries[str(month)] = build_zillow_query(land_use_types, month_start, month_end, fips=fips)
+        return queries
+
+    raise ValueError(f"by must be 'fips' or 'month', not {by!r}")
+
+
+def get_zillow_data(land_use_types=(261,), start_date='2017-05-01', end_date='2017-08-31', fips=None,
+                    cache_format='parquet', memory_map=True, cache_dir='.', pushdown=False):
+    '''
+    This function reads in Zillow data from Codeup database, writes data to
+    a cache file if a local file does not exist, and returns a df.
+    Optional args:
+    land_use_types, start_date, end_date, fips: which rows to pull, see build_zillow_query
+    cache_format: 'parquet' (default), 'feather' or 'csv' (or anything added with register_cache_backend)
+    memory_map: bool, default True. memory map the cache file when reading it
+    cache_dir: folder the cache file lives in. Default is the working directory
+    pushdown: run wrangle steps in the query (see build_zillow_query). The columns come back the same as
+    running those steps in pandas, with the same dtypes, but with a fresh index (0 to n - 1)
+    The cache file name has a fingerprint of the query and database in it, so editing the query
+    pulls fresh data instead of reading an old cache.
+    '''
+    sql_query = build_zillow_query(land_use_types, start_date, end_date, fips, pushdown)
+    
+    path = cache_path(sql_query, 'zillow', cache_format=cache_format, cache_dir=cache_dir)
+    
+    if os.path.isfile(path):
         
-        # If csv file exists read in data from csv file.
-        df = pd.read_csv('zillow_data.csv', index_col=0)
+        # If cache file exists read in data from cache file.
+        df = read_cache(path, cache_format=cache_format, memory_map=memory_map)
         
     else:
         
         # Read fresh data from db into a DataFrame
-        df = pd.read_sql(sql_query, get_db_url('zillow'))
+        df = pd.read_sql(sql_query, get_engine('zillow'))
+        
+        # parse the dates once here, typed formats keep them as datetimes
+        df['transaction_date'] = pd.to_datetime(df.transaction_date)
+        
+        if _pushdown_steps(pushdown):
+            df = _finish_pushdown(df)
         
         # Cache data
-        df.to_csv('zillow_data.csv')
+        write_cache(df, path, cache_format=cache_format)
 
     return df
 
+
+def _finish_pushdown(df):
+    # sql gives NULL for x / 0 where pandas gives inf, put those back
+    if 'tax_rate' in df:
+        zero = (df.tax_value == 0).to_numpy()
+        if zero.any():
+            with np.errstate(divide='ignore', invalid='ignore'):
+                df.loc[zero, 'tax_rate'] = df.tax_amount[zero] / df.tax_value[zero]
+
+    # sql drivers pick their own types (ex: a COALESCE that's all 0 comes back as integers)
+    return df.astype({col: dtype for col, dtype in zillow_chunk_dtypes.items() if col in df})
+
+
+#################################### Partitioned ZILLOW cache ####################################
+
+def _partition_dir(land_use_types, cache_dir):
+    # the dates and counties live in the partitions, so only the rest of the query goes in the fingerprint
+    base_query = build_zillow_query(land_use_types, None, None)
+    
+    return os.path.join(cache_dir, f'zillow_partitions_{query_fingerprint(base_query, "zillow")}')
+
+
+def _read_manifest(partition_dir):
+    path = os.path.join(partition_dir, '_manifest.json')
+    
+    if not os.path.isfile(path):
+        return {'high_water': None, 'partitions': {}}
+    
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_manifest(partition_dir, manifest):
+    path = os.path.join(partition_dir, '_manifest.json')
+    
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(f'{path}.tmp', path)
+
+
+def _partition_file(partition_dir, month, code, cache_format):
+    return os.path.join(partition_dir, f'month={month}', f'fips={code}.{cache_format}')
+
+
+def refresh_zillow_partitions(start_date='2017-05-01', end_date='2017-08-31', fips=zillow_fips, land_use_types=(261,),
+                              force=False, max_workers=None, cache_format='parquet', cache_dir='.', missing_only=False):
+    '''
+    Brings the local Zillow cache, partitioned by transaction month and fips, up to date for the months in
+    start_date to end_date and the counties in fips (ex: a nightly job).
+    Only partitions that are missing, or whose month is at or after the stored high water mark
+    (the newest transaction_date in the cache, so the month that can still get new rows), are pulled.
+    The pulls run at the same time with get_many_data.
+    force: bool. pull every requested partition again
+    missing_only: bool. only pull partitions that aren't cached yet, not the high water month (what loads do)
+    Returns a list of the (month, fips) partitions that were pulled. The database is only touched if that isn't empty.
+    '''
+    partition_dir = _partition_dir(land_use_types, cache_dir)
+    manifest = _read_manifest(partition_dir)
+
+    high_water = manifest['high_water']
+    high_water_month = pd.Timestamp(high_water).to_period('M') if high_water else None
+
+    queries = {}
+    for month in pd.period_range(start_date, end_date, freq='M'):
+        for code in fips:
+            key = f'{month}/{code}'
+            stale = not missing_only and (high_water_month is None or month >= high_water_month)
+            if force or key not in manifest['partitions'] or stale:
+                # partitions always hold whole months, load_zillow_partitions trims to the exact dates
+                queries[(str(month), code)] = build_zillow_query(land_use_types, month.start_time,
+                                                                 month.end_time.normalize(), fips=[code])
+
+    if not queries:
+        return []
+
+    frames = get_many_data('zillow', queries, max_workers=max_workers)
+
+    for (month, code), df in frames.items():
+        df['transaction_date'] = pd.to_datetime(df.transaction_date)
+
+        path = _partition_file(partition_dir, month, code, cache_format)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        
+        # empty partitions are only recorded in the manifest
+        if len(df):
+            write_cache(df, path, cache_format=cache_format)
+        elif os.path.isfile(path):
+            os.remove(path)
+
+        manifest['partitions'][f'{month}/{code}'] = {
+            'rows': len(df),
+            'max_transaction_date': str(df.transaction_date.max().date()) if len(df) else None,
+            'fetched_at': pd.Timestamp.now().isoformat(timespec='seconds'),
+            'cache_format': cache_format,
+        }
+
+    # the high water mark is the newest transaction anywhere in the cache
+    dates = [p['max_transaction_date'] for p in manifest['partitions'].values() if p['max_transaction_date']]
+    manifest['high_water'] = max(dates) if dates else None
+
+    _write_manifest(partition_dir, manifest)
+
+    return list(frames)
+
+
+def load_zillow_partitions(start_date='2017-05-01', end_date='2017-08-31', fips=zillow_fips, land_use_types=(261,),
+                           refresh=False, max_workers=None, cache_format='parquet', cache_dir='.'):
+    '''
+    Returns the raw Zillow data (same columns as get_zillow_data) for transactions from start_date to end_date
+    in the counties in fips, reading only the partitions those dates and counties live in.
+    Partitions that aren't cached yet are pulled first. Once they all are, loading never touches the database
+    (and needs no credentials), keeping the cache up to date is refresh_zillow_partitions' job.
+    refresh: bool, default False. also pull the stale high water month partitions (see refresh_zillow_partitions)
+    '''
+    refresh_zillow_partitions(start_date, end_date, fips, land_use_types, max_workers=max_workers,
+                              cache_format=cache_format, cache_dir=cache_dir, missing_only=not refresh)
+
+    partition_dir = _partition_dir(land_use_types, cache_dir)
+    manifest = _read_manifest(partition_dir)
+
+    frames = []
+    for month in pd.period_range(start_date, end_date, freq='M'):
+        for code in fips:
+            info = manifest['partitions'].get(f'{month}/{code}')
+            if info is None:
+                raise FileNotFoundError(f'Partition {month}/{code} is not cached, run refresh_zillow_partitions')
+            if info['rows']:
+                frames.append(read_cache(_partition_file(partition_dir, month, code, info['cache_format']),
+                                         cache_format=info['cache_format']))
+
+    if not frames:
+        return _empty_zillow_data()
+
+    df = pd.concat(frames, ignore_index=True)
+
+    # trim the first and last month down to the requested dates
+    df = df[df.transaction_date.between(pd.Timestamp(start_date), pd.Timestamp(end_date))]
+
+    return df.reset_index(drop=True)
+
 # old query sql_query = ''' SELECT bedroomcnt, bathroomcnt, calculatedfinishedsquarefeet, taxvaluedollarcnt, yearbuilt, taxamount, fips
    # FROM properties_2017
    # WHERE propertylandusetypeid = 261; '''
@@ -143,12 +1016,18 @@ def missing_values_table(df):
     '''
     this function takes a dataframe as input and will output metrics for missing values, 
     and the percent of that column that has missing values
+    Also takes a DataProfile (ex: get_profile(path)) instead of a dataframe, for data too big to load
     '''
-    # Total missing values
-    mis_val = df.isnull().sum()
+    if isinstance(df, DataProfile):
+        mis_val = pd.Series(df.null_counts, index=df.columns, dtype='int64')
+        n_rows, n_cols = df.n_rows, len(df.columns)
+    else:
+        # Total missing values
+        mis_val = df.isnull().sum()
+        n_rows, n_cols = df.shape
     
     # Percentage of missing values
-    mis_val_percent = 100 * df.isnull().sum() / len(df)
+    mis_val_percent = 100 * mis_val / n_rows
     
     # Make a table with the results
     mis_val_table = pd.concat([mis_val, mis_val_percent], axis=1)
@@ -163,7 +1042,7 @@ def missing_values_table(df):
     '% of Total Values', ascending=False).round(1)
     
     # Print some summary information
-    print ("Your selected dataframe has " + str(df.shape[1]) + " columns.\n"      
+    print ("Your selected dataframe has " + str(n_cols) + " columns.\n"      
         "There are " + str(mis_val_table_ren_columns.shape[0]) +
         " columns that have missing values.")
         
@@ -171,6 +1050,279 @@ def missing_values_table(df):
     return mis_val_table_ren_columns
 
 
+#################################### Data profile ####################################
+
+# HyperLogLog registers per column for the distinct counts: 2 ** 12 registers, about 1.6% error
+_hll_precision = 12
+
+
+def _hll_update(registers, values):
+    # adds hashed values to one column's HyperLogLog registers (in place)
+    hashes = pd.util.hash_array(np.asarray(values))
+    bucket = (hashes >> np.uint64(64 - _hll_precision)).astype(np.int64)
+    rest = (hashes & np.uint64((1 << (64 - _hll_precision)) - 1)).astype(np.float64)
+
+    # rank = position of the first 1 bit in the rest of the hash. frexp gives the exact bit length
+    _, bit_length = np.frexp(rest)
+    rank = np.where(rest > 0, 64 - _hll_precision - bit_length + 1, 64 - _hll_precision + 1).astype(np.uint8)
+
+    np.maximum.at(registers, bucket, rank)
+
+
+def _hll_count(registers):
+    # HyperLogLog estimate, with linear counting while most registers are still empty
+    m = len(registers)
+    estimate = 0.7213 / (1 + 1.079 / m) * m ** 2 / np.sum(2.0 ** -registers.astype(float))
+    zeros = np.count_nonzero(registers == 0)
+    if estimate <= 2.5 * m and zeros:
+        estimate = m * np.log(m / zeros)
+
+    return int(round(estimate))
+
+
+class DataProfile:
+    '''
+    Data quality profile of a dataframe, built one chunk at a time in a single pass:
+    per column null counts, min and max (numbers and dates) and approximate distinct counts (HyperLogLog),
+    rows with any null, duplicate rows (by hashing each row) and rows with 0 bathrooms.
+    Profiles of different chunks can be combined with merge, so it works on streamed data.
+    Memory is O(unique rows): one 8 byte hash per distinct row is kept to find duplicates across chunks
+    (the rest is a fixed size per column).
+    ex:
+        profile = DataProfile()
+        for chunk in iter_cache(path):
+            profile.update(chunk)
+        missing_values_table(profile)
+    '''
+    def __init__(self):
+        self.n_rows = 0
+        self.columns = []
+        self.dtypes = {}
+        self.null_counts = {}
+        self.mins = {}
+        self.maxs = {}
+        self.registers = {}
+        self.rows_with_nulls = 0
+        self.zero_bathrooms = 0
+        # sorted unique row hashes. None after loading from json (only the duplicate count is saved)
+        self.row_hashes = np.empty(0, dtype=np.uint64)
+        # hashes of the chunks since then, deduplicated into row_hashes in one go (see _compact_row_hashes)
+        self._pending_hashes = []
+        self._pending_rows = 0
+        self._duplicates = 0
+
+    def _add_column(self, col, dtype):
+        self.columns.append(col)
+        self.dtypes[col] = str(dtype)
+        self.null_counts[col] = 0
+        self.mins[col] = None
+        self.maxs[col] = None
+        self.registers[col] = np.zeros(2 ** _hll_precision, dtype=np.uint8)
+
+    def update(self, df):
+        '''
+        Adds a chunk (a dataframe with the same columns as the other chunks).
+        '''
+        for col in df.columns:
+            if col not in self.null_counts:
+                self._add_column(col, df[col].dtype)
+
+        # one null mask for the whole chunk
+        nulls = df.isna().to_numpy()
+        self.rows_with_nulls += int(nulls.any(axis=1).sum())
+        self.n_rows += len(df)
+
+        for i, col in enumerate(df.columns):
+            values = df[col].to_numpy()[~nulls[:, i]]
+            self.null_counts[col] += int(nulls[:, i].sum())
+            if len(values):
+                _hll_update(self.registers[col], values)
+                if np.issubdtype(values.dtype, np.number) or np.issubdtype(values.dtype, np.datetime64):
+                    low, high = values.min(), values.max()
+                    self.mins[col] = low if self.mins[col] is None else min(self.mins[col], low)
+                    self.maxs[col] = high if self.maxs[col] is None else max(self.maxs[col], high)
+
+        if 'bathroom_cnt' in df:
+            self.zero_bathrooms += int((df.bathroom_cnt == 0).sum())
+
+        self._add_row_hashes(pd.util.hash_pandas_object(df, index=False).to_numpy())
+
+        return self
+
+    def _add_row_hashes(self, hashes, duplicates=0):
+        if self.row_hashes is None:
+            return
+        self._pending_hashes.append(hashes)
+        self._pending_rows += len(hashes)
+        self._duplicates += duplicates
+
+        # sorting everything on every chunk would be O(chunks * N log N). Waiting until the pending hashes
+        # are as many as the unique ones keeps the total O(N log N), with at most about twice the unique hashes in memory
+        if self._pending_rows >= len(self.row_hashes):
+            self._compact_row_hashes()
+
+    def _compact_row_hashes(self):
+        # one sort of the unique hashes and the pending ones, rows already seen are duplicates
+        if self.row_hashes is None or not self._pending_hashes:
+            return
+        before = len(self.row_hashes) + self._pending_rows
+        self.row_hashes = np.unique(np.concatenate([self.row_hashes] + self._pending_hashes))
+        self._duplicates += before - len(self.row_hashes)
+        self._pending_hashes = []
+        self._pending_rows = 0
+
+    def merge(self, other):
+        '''
+        Adds the chunks counted by another DataProfile.
+        If either one was loaded from json the duplicate counts are just added up (rows duplicated across
+        the two aren't caught).
+        '''
+        for col in other.columns:
+            if col not in self.null_counts:
+                self._add_column(col, other.dtypes[col])
+            self.null_counts[col] += other.null_counts[col]
+            for mine, theirs, pick in ((self.mins, other.mins, min), (self.maxs, other.maxs, max)):
+                if theirs[col] is not None:
+                    mine[col] = theirs[col] if mine[col] is None else pick(mine[col], theirs[col])
+            np.maximum(self.registers[col], other.registers[col], out=self.registers[col])
+
+        self.n_rows += other.n_rows
+        self.rows_with_nulls += other.rows_with_nulls
+        self.zero_bathrooms += other.zero_bathrooms
+
+        if self.row_hashes is None or other.row_hashes is None:
+            self._duplicates = self.duplicate_rows + other.duplicate_rows
+            self.row_hashes = None
+            self._pending_hashes = []
+            self._pending_rows = 0
+        else:
+            other._compact_row_hashes()
+            self._add_row_hashes(other.row_hashes, other._duplicates)
+
+        return self
+
+    @property
+    def duplicate_rows(self):
+        '''
+        Rows that are an exact copy of an earlier row (what drop_duplicates would drop).
+        '''
+        self._compact_row_hashes()
+        return self._duplicates
+
+    def report(self):
+        '''
+        Returns a dataframe with one row per column: nulls, % nulls, min, max and approximate distinct values.
+        '''
+        return pd.DataFrame({'Missing Values': pd.Series(self.null_counts),
+                             '% of Total Values': 100 * pd.Series(self.null_counts) / max(self.n_rows, 1),
+                             'Min': pd.Series(self.mins),
+                             'Max': pd.Series(self.maxs),
+                             'Distinct (approx)': pd.Series({col: _hll_count(registers)
+                                                             for col, registers in self.registers.items()})},
+                            index=self.columns)
+
+    def summary(self):
+        '''
+        Returns a dictionary of the whole table numbers: rows, rows with nulls, duplicate rows, rows with 0 bathrooms.
+        '''
+        return {'rows': self.n_rows,
+                'rows_with_nulls': self.rows_with_nulls,
+                'duplicate_rows': self.duplicate_rows,
+                'zero_bathrooms': self.zero_bathrooms}
+
+    def to_json(self):
+        '''
+        Returns the profile as a json string (without the row hashes, see from_json).
+        '''
+        def plain(value):
+            # numpy numbers and dates to something json can hold
+            if value is None:
+                return None
+            if isinstance(value, np.datetime64):
+                return str(pd.Timestamp(value))
+            return value.item() if hasattr(value, 'item') else value
+
+        return json.dumps({'n_rows': self.n_rows,
+                           'columns': self.columns,
+                           'dtypes': self.dtypes,
+                           'null_counts': self.null_counts,
+                           'mins': {col: plain(value) for col, value in self.mins.items()},
+                           'maxs': {col: plain(value) for col, value in self.maxs.items()},
+                           'registers': {col: registers.tolist() for col, registers in self.registers.items()},
+                           'rows_with_nulls': self.rows_with_nulls,
+                           'zero_bathrooms': self.zero_bathrooms,
+                           'duplicate_rows': self.duplicate_rows})
+
+    @classmethod
+    def from_json(cls, text):
+        '''
+        Makes a DataProfile from to_json. It reports the same numbers, but has no row hashes
+        (so merging it only adds up duplicate counts).
+        '''
+        saved = json.loads(text)
+        profile = cls()
+        for key in ('n_rows', 'columns', 'dtypes', 'null_counts', 'rows_with_nulls', 'zero_bathrooms'):
+            setattr(profile, key, saved[key])
+        for key in ('mins', 'maxs'):
+            setattr(profile, key, {col: (np.datetime64(pd.Timestamp(value))
+                                         if value is not None and saved['dtypes'][col].startswith('datetime64')
+                                         else value)
+                                   for col, value in saved[key].items()})
+        profile.registers = {col: np.array(registers, dtype=np.uint8) for col, registers in saved['registers'].items()}
+        profile.row_hashes = None
+        profile._duplicates = saved['duplicate_rows']
+
+        return profile
+
+
+def profile_chunks(chunks):
+    '''
+    Profiles an iterable of dataframe chunks (ex: iter_cache(path)) in one pass. Returns a DataProfile.
+    '''
+    profile = DataProfile()
+    for chunk in chunks:
+        profile.update(chunk)
+
+    return profile
+
+
+def get_profile(path, cache_format='parquet', chunksize=50_000):
+    '''
+    Returns the DataProfile of a cache file (ex: from cache_path or stream_zillow_data).
+    The profile is saved next to the cache file (same name + .profile.json) the first time, and read back
+    after that, as long as the cache file hasn't changed since. The cache is read chunksize rows at a time.
+    ex: missing_values_table(get_profile(path))
+    '''
+    saved = f'{path}.profile.json'
+
+    if os.path.isfile(saved) and os.path.getmtime(saved) >= os.path.getmtime(path):
+        with open(saved) as f:
+            return DataProfile.from_json(f.read())
+
+    profile = profile_chunks(iter_cache(path, cache_format=cache_format, chunksize=chunksize))
+
+    # temporary name first, like write_cache
+    with open(f'{saved}.tmp', 'w') as f:
+        f.write(profile.to_json())
+    os.replace(f'{saved}.tmp', saved)
+
+    return profile
+
+
+def get_zillow_profile(land_use_types=(261,), start_date='2017-05-01', end_date='2017-08-31', fips=None,
+                       cache_format='parquet', cache_dir='.'):
+    '''
+    Returns the DataProfile of the raw Zillow data (same args as get_zillow_data), from the profile saved
+    next to the data cache when there is one. Pulls the data first if it isn't cached yet.
+    '''
+    path = cache_path(build_zillow_query(land_use_types, start_date, end_date, fips), 'zillow',
+                      cache_format=cache_format, cache_dir=cache_dir)
+
+    if not os.path.isfile(path):
+        get_zillow_data(land_use_types, start_date, end_date, fips, cache_format=cache_format, cache_dir=cache_dir)
+
+    return get_profile(path, cache_format=cache_format)
+
 #################################### handle NaNs ####################################
 
 def handle_NaNs(df):
@@ -209,9 +1361,197 @@ def remove_outlier(df):
     This function takes in a dataframe
     It outputs a the dataframe with the outliers that have a Z score above 3 or below -3 removed
     '''
+    import scipy.stats as stats
+
     df = df[(np.abs(stats.zscore(df)) < 3).all(axis=1)]
     return df
 
+
+class RunningMoments:
+    '''
+    Running count, mean and sum of squared differences from the mean (M2) for each column,
+    updated one chunk at a time with Welford's algorithm (Chan's version, which adds a whole chunk at once).
+    Two of these can be combined with merge, so chunks can be counted on different workers.
+    std is the population standard deviation (ddof=0), the one scipy.stats.zscore uses.
+    '''
+    def __init__(self):
+        self.n = 0
+        self.mean = None
+        self.m2 = None
+
+    def update(self, values):
+        '''
+        Adds a chunk. values: 2d array (rows x columns) or 1d array for one column.
+        '''
+        values = np.asarray(values, dtype=float)
+        if values.ndim == 1:
+            values = values[:, None]
+        if len(values) == 0:
+            return self
+
+        mean = values.mean(axis=0)
+        m2 = ((values - mean) ** 2).sum(axis=0)
+
+        return self._combine(len(values), mean, m2)
+
+    def merge(self, other):
+        '''
+        Adds the chunks counted by another RunningMoments.
+        '''
+        if other.n:
+            self._combine(other.n, other.mean, other.m2)
+        return self
+
+    def _combine(self, n, mean, m2):
+        if self.n == 0:
+            self.n, self.mean, self.m2 = n, mean, m2
+            return self
+
+        total = self.n + n
+        delta = mean - self.mean
+        self.mean = self.mean + delta * (n / total)
+        self.m2 = self.m2 + m2 + delta ** 2 * (self.n * n / total)
+        self.n = total
+
+        return self
+
+    @property
+    def var(self):
+        return self.m2 / self.n
+
+    @property
+    def std(self):
+        return np.sqrt(self.var)
+
+
+class QuantileSketch:
+    '''
+    Mergeable quantile sketch for one column (a simple KLL style compactor).
+    Values go into level 0. When a level has more than k values it is sorted and every other value
+    (random start) moves up a level, where each value stands for twice as many rows.
+    Exact until more than k values have been added, after that quantiles are off by roughly 1/k in rank.
+    Memory is about k values per level, and there are log2(rows / k) levels.
+    '''
+    def __init__(self, k=4096, seed=713):
+        self.k = k
+        self.n = 0
+        self.levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def update(self, values):
+        '''
+        Adds a chunk of values (NaNs are skipped).
+        '''
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self.n += len(values)
+        self._compact()
+
+        return self
+
+    def merge(self, other):
+        '''
+        Adds the values counted by another QuantileSketch.
+        '''
+        for i, level in enumerate(other.levels):
+            if i == len(self.levels):
+                self.levels.append(np.empty(0))
+            self.levels[i] = np.concatenate([self.levels[i], level])
+        self.n += other.n
+        self._compact()
+
+        return self
+
+    def _compact(self):
+        i = 0
+        while i < len(self.levels):
+            if len(self.levels[i]) > self.k:
+                level = np.sort(self.levels[i])
+                # an odd value out stays on this level
+                even = len(level) - len(level) % 2
+                self.levels[i] = level[even:]
+                if i + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                self.levels[i + 1] = np.concatenate([self.levels[i + 1], level[self._rng.integers(2):even:2]])
+            i += 1
+
+    def quantile(self, q):
+        '''
+        Returns the q quantile (q can be a list). Same as np.quantile while the sketch is still exact.
+        '''
+        if len(self.levels) == 1:
+            return np.quantile(self.levels[0], q)
+
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 2.0 ** i) for i, level in enumerate(self.levels)])
+        order = np.argsort(items, kind='stable')
+        cum_weights = np.cumsum(weights[order])
+
+        idx = np.searchsorted(cum_weights, np.asarray(q) * cum_weights[-1], side='left')
+        return items[order][np.minimum(idx, len(items) - 1)]
+
+
+def _rereadable_chunks(chunks):
+    # a function that gives the chunks again every time it's called. A generator would be used up by the first pass
+    # and the next pass would quietly see no data, so those are refused
+    if callable(chunks):
+        return chunks
+    if iter(chunks) is chunks:
+        raise TypeError('chunks is read more than once, pass a function that returns the chunks '
+                        '(ex: lambda: iter_cache(path)) or a list of dataframes, not a generator or iterator')
+    return lambda: chunks
+
+
+def remove_outlier_streaming(chunks, columns=('sqft_calculated', 'bedroom_cnt', 'bathroom_cnt'),
+                             method='zscore', threshold=3, iqr_k=1.5):
+    '''
+    Removes outliers from data that comes in chunks, using statistics of the whole data set, in two passes.
+    The first pass goes through every chunk to get each column's mean and std (method='zscore', see RunningMoments)
+    or quartiles (method='iqr', see QuantileSketch). The second pass filters each chunk.
+    chunks: a function that returns a new iterable of dataframe chunks each time it's called
+    (ex: lambda: iter_cache(path)), or a list of dataframes. Not a generator or iterator, since it can only be read once.
+    columns: columns to look for outliers in
+    threshold: zscore method, rows with a Z score above threshold or below -threshold in any column are removed.
+    With one chunk this is exactly remove_outlier; with more chunks the mean and std can differ in the last
+    digit, so only a row sitting right on the cutoff could come out differently.
+    iqr_k: iqr method, rows below Q1 - iqr_k * IQR or above Q3 + iqr_k * IQR in any column are removed
+    Yields the chunks with the outlier rows removed.
+    '''
+    get_chunks = _rereadable_chunks(chunks)
+    columns = list(columns)
+
+    # first pass, statistics over every chunk
+    if method == 'zscore':
+        moments = RunningMoments()
+        for chunk in get_chunks():
+            moments.update(chunk[columns].to_numpy())
+            
+    elif method == 'iqr':
+        sketches = [QuantileSketch() for _ in columns]
+        for chunk in get_chunks():
+            for sketch, col in zip(sketches, columns):
+                sketch.update(chunk[col].to_numpy())
+                
+        q1, q3 = np.array([sketch.quantile([.25, .75]) for sketch in sketches]).T
+        lower = q1 - iqr_k * (q3 - q1)
+        upper = q3 + iqr_k * (q3 - q1)
+        
+    else:
+        raise ValueError(f"method must be 'zscore' or 'iqr', not {method!r}")
+
+    # second pass, filter each chunk
+    for chunk in get_chunks():
+        values = chunk[columns].to_numpy()
+        
+        if method == 'zscore':
+            keep = (np.abs((values - moments.mean) / moments.std) < threshold).all(axis=1)
+        else:
+            keep = ((values >= lower) & (values <= upper)).all(axis=1)
+            
+        yield chunk[keep]
+
 #################################### pools and garages ####################################
 def pool_and_garage(df):
     '''
@@ -220,7 +1560,7 @@ def pool_and_garage(df):
     '''
     df['has_pool'] = df.has_pool.fillna(value=0)
 
-    df.garage_car_count.fillna(value=0, inplace=True)
+    df['garage_car_count'] = df.garage_car_count.fillna(value=0)
 
     df['has_garage'] = (df.garage_car_count != 0).astype(int)
 
@@ -244,17 +1584,34 @@ def cali_counties(df):
 
     return df
 
-#################################### Function to get Zillow Data ####################################
+#################################### Streaming Zillow Data ####################################
 
-def wrangle_zillow():
-    '''
-    This function handels getting the data from the zillow database and getting rid of the unneeded rows.
-    It returns the dataframe ready to work with.
-    Uses other helper functions in wrangle.py to get this done. 
-    '''
+# dtypes of a chunk after wrangle_chunk. Every chunk is cast to these so they all share one schema in the cache.
+# transaction_date isn't cast: it stays what pd.to_datetime gives, like in get_zillow_data
+# (the unit depends on the pandas version and on what the database driver hands back)
+zillow_chunk_dtypes = {
+    'parcel_id': 'int64',
+    'tax_value': 'float64',
+    'bathroom_cnt': 'float64',
+    'bedroom_cnt': 'float64',
+    'sqft_calculated': 'float64',
+    'has_pool': 'float64',
+    'fips': 'float64',
+    'tax_amount': 'float64',
+    'has_garage': 'int64',
+    'county': 'object',
+    'tax_rate': 'float64',
+}
 
-    df = get_zillow_data()
 
+def wrangle_chunk(df):
+    '''
+    Takes in a chunk of raw Zillow data (columns from get_zillow_data) and runs the row by row wrangle steps on it:
+    pool_and_garage, cali_counties, tax_rate and drop_the_cols (NaNs and 0 bathrooms).
+    None of these need to see the other rows, so running them chunk by chunk gives the same rows as running them on everything.
+    Outliers are not removed here, z scores need the whole column.
+    Returns the wrangled chunk cast to zillow_chunk_dtypes (transaction_date as pd.to_datetime gives it).
+    '''
     df = pool_and_garage(df)
 
     df = cali_counties(df)
@@ -265,13 +1622,301 @@ def wrangle_zillow():
 
     df['transaction_date'] = pd.to_datetime(df.transaction_date)
 
+    return df.astype(zillow_chunk_dtypes)
+
+
+def stream_zillow_data(chunksize=50_000, land_use_types=(261,), start_date='2017-05-01', end_date='2017-08-31', fips=None,
+                       cache_format='parquet', cache_dir='.'):
+    '''
+    Streams Zillow data from the Codeup database chunksize rows at a time, runs wrangle_chunk on every chunk
+    and appends it to a cache file, so only one chunk is ever in memory.
+    Use it to pull more than the project slice, ex: every land use type for all of 2017:
+        stream_zillow_data(land_use_types=None, start_date='2017-01-01', end_date='2017-12-31')
+    The rows keep the index they would have had in one big read_sql, so results line up with get_zillow_data.
+    If the cache file for this query already exists nothing is pulled.
+    Returns the path to the cache file (read it with read_cache, or chunk by chunk with iter_cache).
+    '''
+    sql_query = build_zillow_query(land_use_types, start_date, end_date, fips)
+
+    path = cache_path(sql_query, 'zillow', cache_format=cache_format, prefix='zillow_wrangled', cache_dir=cache_dir)
+
+    if not os.path.isfile(path):
+
+        def wrangled_chunks():
+            offset = 0
+            for chunk in get_any_data('zillow', sql_query, chunksize=chunksize):
+                # number rows across chunks, read_sql starts each chunk at 0
+                chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+                offset += len(chunk)
+                yield wrangle_chunk(chunk)
+
+        empty = wrangle_chunk(_empty_zillow_data())
+
+        write_cache_chunks(wrangled_chunks(), path, cache_format=cache_format, empty=empty)
+
+    return path
+
+#################################### Instrumented stages ####################################
+
+# functions called with the record of every stage run with run_stages (see add_stage_hook)
+stage_hooks = []
+
+# records of the last run_stages call that was instrumented
+last_stage_report = []
+
+
+def add_stage_hook(hook):
+    '''
+    Registers hook to be called after every stage of run_stages (so every wrangle_zillow step) with the stage's record,
+    a dictionary with: stage, wall_s, cpu_s, rows_in, rows_out, bytes_by_column, peak_rss_mb, and with
+    trace_memory also traced_peak_mb and traced_retained_mb.
+    ex: add_stage_hook(lambda record: print(record['stage'], record['wall_s'], record['rows_out']))
+    Returns hook, so it can be used as a decorator.
+    '''
+    stage_hooks.append(hook)
+
+    return hook
+
+
+def _rows(data):
+    # row count of a stage's input or output, None for things that aren't dataframes (ex: a cache path)
+    return len(data) if isinstance(data, (pd.DataFrame, pd.Series)) else None
+
+
+def _peak_rss_mb():
+    # peak resident memory of this process so far (ru_maxrss is kB on linux, bytes on mac)
+    try:
+        import resource
+    except ImportError:
+        return None
+    import sys
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1e6 if sys.platform == 'darwin' else peak / 1e3
+
+
+def run_stages(data, stages, instrument=False, trace_memory=False, hooks=None, report_path=None):
+    '''
+    Runs data through stages, a list of (name, function) pairs: every function takes the output of the one before.
+    instrument: bool. record wall time, cpu time, rows in and out, bytes per column (shallow, no looking inside
+    strings) and the peak RSS of the process for every stage. Cheap enough to leave on.
+    With instrument False and no hooks registered the stages just run, nothing is measured.
+    trace_memory: bool. also trace python allocations with tracemalloc for the peak and retained memory of
+    each stage (slows the stages down a lot, use it when looking for where the memory goes)
+    hooks: functions called with each stage's record, on top of the ones from add_stage_hook
+    report_path: write the records to this json file
+    The records of the last instrumented run are also kept in last_stage_report.
+    Returns the output of the last stage.
+    '''
+    hooks = stage_hooks + list(hooks or [])
+
+    if not (instrument or trace_memory or hooks or report_path):
+        for name, func in stages:
+            data = func(data)
+        return data
+
+    import time
+    import tracemalloc
+
+    report = []
+    tracing = trace_memory and not tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.start()
+
+    try:
+        for name, func in stages:
+            rows_in = _rows(data)
+            if trace_memory:
+                before, _ = tracemalloc.get_traced_memory()
+                tracemalloc.reset_peak()
+            wall, cpu = time.perf_counter(), time.process_time()
+
+            data = func(data)
+
+            record = {'stage': name,
+                      'wall_s': time.perf_counter() - wall,
+                      'cpu_s': time.process_time() - cpu,
+                      'rows_in': rows_in,
+                      'rows_out': _rows(data),
+                      'bytes_by_column': ({col: int(size) for col, size in data.memory_usage(index=False).items()}
+                                          if isinstance(data, pd.DataFrame) else None),
+                      'peak_rss_mb': _peak_rss_mb()}
+            if trace_memory:
+                current, peak = tracemalloc.get_traced_memory()
+                record['traced_peak_mb'] = (peak - before) / 1e6
+                record['traced_retained_mb'] = (current - before) / 1e6
+
+            report.append(record)
+            for hook in hooks:
+                hook(record)
+    finally:
+        if tracing:
+            tracemalloc.stop()
+
+    last_stage_report[:] = report
+
+    if report_path is not None:
+        with open(report_path, 'w') as f:
+            json.dump({'stages': report,
+                       'total_wall_s': sum(record['wall_s'] for record in report),
+                       'total_cpu_s': sum(record['cpu_s'] for record in report)}, f, indent=2)
+
+    return data
+
+
+def _tax_rate(df):
+    df['tax_rate'] = df.tax_amount / df.tax_value
+    return df
+
+
+def _transaction_datetime(df):
+    df['transaction_date'] = pd.to_datetime(df.transaction_date)
+    return df
+
+
+def _drop_outliers(df):
     # Remove outliers from columns that need to be removed
     df_outliers = remove_outlier(df[['sqft_calculated', 'bedroom_cnt', 'bathroom_cnt']])
 
     # only put back the ones that had outliers in it 
-    df = df[df.index.isin(df_outliers.index)]
+    return df[df.index.isin(df_outliers.index)]
 
-    return df
 
+def _remove_cached_outliers(path, chunksize):
+    # Remove outliers chunk by chunk, with z scores from the whole column
+    chunks = list(remove_outlier_streaming(lambda: iter_cache(path, chunksize=chunksize)))
+    df = pd.concat(chunks) if chunks else read_cache(path)
+
+    # back to the wrangle_chunk dtypes, reading the cache can give other ones (ex: str county on pandas 3)
+    return df.astype(zillow_chunk_dtypes)
 
 
+# the steps of clean_zillow, in order
+clean_zillow_stages = [('pool_and_garage', pool_and_garage),
+                       ('cali_counties', cali_counties),
+                       ('tax_rate', _tax_rate),
+                       ('drop_the_cols', drop_the_cols),
+                       ('to_datetime', _transaction_datetime),
+                       ('remove_outlier', _drop_outliers)]
+
+#################################### Function to get Zillow Data ####################################
+
+def wrangle_zillow(chunksize=None, land_use_types=(261,), start_date='2017-05-01', end_date='2017-08-31',
+                   fips=None, partitioned=False, fused=False, downcast=False, pushdown=False,
+                   instrument=False, trace_memory=False, hooks=None, report_path=None):
+    '''
+    This function handels getting the data from the zillow database and getting rid of the unneeded rows.
+    It returns the dataframe ready to work with.
+    Uses other helper functions in wrangle.py to get this done. 
+    Optional args:
+    chunksize: when set, the data is streamed from the database chunksize rows at a time (see stream_zillow_data)
+    and outliers are removed chunk by chunk (see remove_outlier_streaming)
+    land_use_types, start_date, end_date, fips: which rows to pull, see build_zillow_query
+    partitioned: bool. read from the month/county partitioned cache, only touching the partitions
+    for start_date to end_date and fips, and only pulling the ones that are missing (see load_zillow_partitions)
+    fused: bool. wrangle in one pass with fused_wrangle instead of step by step (same output, less memory)
+    downcast: bool. with fused, use smaller dtypes (see fused_wrangle)
+    pushdown: run pool_and_garage, cali_counties, tax_rate and drop_the_cols in the sql query (True) or just the
+    first few of them (see build_zillow_query), the rest of the steps run in pandas. Same rows, columns and
+    dtypes as running every step in pandas, but the index is 0 to n - 1 from the query (before outliers are removed).
+    Only for the step by step path (ignored with chunksize or partitioned, and fused is ignored with it)
+    instrument, trace_memory, hooks, report_path: time and measure every step, see run_stages
+    ex: df = wrangle_zillow(instrument=True, report_path='wrangle_report.json')
+    '''
+    if chunksize is not None:
+        stages = [('stream_zillow_data',
+                   lambda _: stream_zillow_data(chunksize, land_use_types, start_date, end_date, fips)),
+                  ('remove_outlier_streaming', lambda path: _remove_cached_outliers(path, chunksize))]
+    else:
+        if partitioned:
+            stages = [('load_zillow_partitions',
+                       lambda _: load_zillow_partitions(start_date, end_date, fips or zillow_fips, land_use_types))]
+        else:
+            stages = [('get_zillow_data',
+                       lambda _: get_zillow_data(land_use_types, start_date, end_date, fips, pushdown=pushdown))]
+
+        # steps done in the query (the partitioned cache always has the raw columns)
+        pushed = () if partitioned else _pushdown_steps(pushdown)
+
+        if fused and not pushed:
+            stages.append(('fused_wrangle', lambda df: fused_wrangle(df, downcast=downcast)))
+        else:
+            stages.extend(clean_zillow_stages[len(pushed):])
+
+    return run_stages(None, stages, instrument, trace_memory, hooks, report_path)
+
+
+def clean_zillow(df, instrument=False, trace_memory=False, hooks=None, report_path=None):
+    '''
+    Takes in the raw Zillow data from get_zillow_data and runs the wrangle steps on it one after the other:
+    pool_and_garage, cali_counties, tax_rate, drop_the_cols, transaction_date to datetime and remove_outlier
+    on sqft_calculated, bedroom_cnt and bathroom_cnt (the stages in clean_zillow_stages).
+    instrument, trace_memory, hooks, report_path: time and measure every step, see run_stages
+    Returns the dataframe ready to work with.
+    '''
+    return run_stages(df, clean_zillow_stages, instrument, trace_memory, hooks, report_path)
+
+
+def fused_wrangle(df, downcast=False):
+    '''
+    Does the same thing as clean_zillow in one pass. Instead of every step making a new dataframe,
+    it builds one boolean mask of the rows to keep (no NaNs, bathrooms, outliers) from the columns,
+    selects those rows once, and only then fills pools/garages and maps counties on the kept rows.
+    Assumes the index has no repeated labels (true for get_zillow_data).
+    Returns the same dataframe as clean_zillow.
+    Optional arg downcast: bool. when True uses smaller dtypes (float32 sqft_calculated and bathroom_cnt,
+    int8 bedroom_cnt, has_pool and has_garage, category county). Same rows, less memory, but not identical dtypes.
+    '''
+    import scipy.stats as stats
+
+    counties = {6037: 'LA', 6059: 'Orange', 6111: 'Ventura'}
+
+    # tax_rate is needed for the mask, a 0/0 rate is a NaN that drop_the_cols would drop
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tax_rate = df.tax_amount.to_numpy() / df.tax_value.to_numpy()
+
+    # has_pool and garage_car_count get filled in, every other column has to be there
+    keep = ~np.isnan(tax_rate) & (df.bathroom_cnt.to_numpy() != 0)
+    for col in df.columns:
+        if col not in ('has_pool', 'garage_car_count'):
+            keep &= df[col].notna().to_numpy()
+    rows = np.flatnonzero(keep)
+
+    # z scores of the rows that are left. Stacked the same way pandas hands them to remove_outlier,
+    # so the floating point sums come out exactly the same
+    outlier_cols = ['sqft_calculated', 'bedroom_cnt', 'bathroom_cnt']
+    values = np.empty((len(outlier_cols), len(rows)))
+    for i, col in enumerate(outlier_cols):
+        values[i] = df[col].to_numpy()[rows]
+    rows = rows[(np.abs(stats.zscore(values.T)) < 3).all(axis=1)]
+
+    # the one row selection
+    df = df.take(rows)
+
+    df['has_pool'] = df.has_pool.fillna(0)
+
+    garage = df.pop('garage_car_count')
+    df['has_garage'] = (garage.fillna(0) != 0).astype(int)
+
+    # fips that are not in counties keep their fips value, like .replace does
+    # object like .replace gives, pandas 3 would make mapped strings its own str dtype
+    county = df.fips.map(counties).astype(object)
+    if county.isna().any():
+        county = county.fillna(df.fips)
+    df['county'] = county
+
+    df['tax_rate'] = tax_rate[rows]
+
+    df['transaction_date'] = pd.to_datetime(df.transaction_date)
+
+    if downcast:
+        df = df.astype({
+            'sqft_calculated': 'float32',
+            'bathroom_cnt': 'float32',
+            'bedroom_cnt': 'int8',
+            'has_pool': 'int8',
+            'has_garage': 'int8',
+            'county': 'category',
+        })
+
+    return df